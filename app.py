@@ -1,18 +1,54 @@
+import json
 import logging
 import os
-import base64
-import asyncio
+import re
+import uuid
+import time
 from threading import Semaphore
-from flask import Flask, render_template, jsonify, request
-from playwright.sync_api import sync_playwright, Playwright
+from flask import Flask, Response, render_template, jsonify, request, url_for, send_file, stream_with_context
+from browser_pool import BATCH_PARALLELISM, BatchBrowser, BrowserPool, run_batch
+from jobs import FINISHED_STATES, JOB_CONCURRENCY, JobQueue, QueueFullError
+from memory_guard import MemoryPressureError, memory_guard
+from audio_store import audio_path, discard_audio, find_screenshot, prune_spool, screenshot_path
+from diagnostics import ARTIFACT_ID_RE, diagnostics
+from result_cache import ResultCache, extract_video_id
+from pipeline import resolve_screenshot_options, run_conversion
+from fast_path import FAST_PATH_ENABLED, FastPathError, convert as convert_without_browser
+from hedging import CONVERTER_HEDGING, backends, convert_hedged
+from sites import get_site
+from metrics import (
+    BROWSERS_HEALTHY, CACHE_BYTES, CACHE_LOOKUPS, COALESCED, CONVERSION_PATHS, JOBS_RUNNING, QUEUE_DEPTH,
+    REJECTIONS, RSS_BYTES,
+    job_outcome, observe_download, observe_stages, process_tree_rss, record_job, render as render_metrics
+)
 
 # Configure logging for Render.com
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 app = Flask(__name__)
 
-# Semaphore to allow only 1 conversion at a time (prevents memory bloat)
-conversion_semaphore = Semaphore(1)
+# Upper bound for one conversion including time spent waiting for a browser (gunicorn timeout is 120s)
+CONVERSION_TIMEOUT = float(os.environ.get('CONVERSION_TIMEOUT', 110))
+
+# An idle /jobs/<id>/events stream sends a keep-alive comment this often
+EVENTS_KEEPALIVE = float(os.environ.get('EVENTS_KEEPALIVE', 15))
+# Streams are closed after this long so they don't pin HTTP threads; EventSource
+# reconnects on its own and resumes from Last-Event-ID
+EVENTS_MAX_STREAM_SECONDS = float(os.environ.get('EVENTS_MAX_STREAM_SECONDS', 30))
+# Each open stream holds an HTTP thread, so only this many run at once (keep it well
+# below gunicorn's --threads); extra clients get a 503 and poll /jobs/<id> instead
+EVENTS_MAX_STREAMS = int(os.environ.get('EVENTS_MAX_STREAMS', 4))
+events_semaphore = Semaphore(EVENTS_MAX_STREAMS)
+
+# Limits for /batch - a batch gets its own shared multi-process browser (in a worker process)
+BATCH_MAX_URLS = int(os.environ.get('BATCH_MAX_URLS', 50))
+BATCH_MAX_PARALLELISM = int(os.environ.get('BATCH_MAX_PARALLELISM', 5))
+# Only one batch browser at a time (prevents memory bloat)
+batch_semaphore = Semaphore(1)
+
+# Warm Chromium pool - browsers run in their own worker processes and are reused across conversions
+browser_pool = BrowserPool()
+browser_pool.start()
 
 @app.route('/')
 def index():
@@ -24,9 +60,9 @@ def launch_chromium():
     try:
         logging.info("Launch endpoint called - using lightweight check")
         
-        # Don't actually launch browser here - just return success to save memory
-        # The actual browser will only launch when user submits a URL
-        logging.info('Ready to process URLs on youconvert.org!')
+        # Don't launch anything here - the browser pool is already warm (or warming up)
+        browser_pool.start()
+        logging.info(f'Ready to process URLs on {get_site().host}!')
         return jsonify({
             'status': 'success',
             'message': 'Ready to convert! Enter a URL to start.',
@@ -37,13 +73,119 @@ def launch_chromium():
         logging.critical(f"Unhandled exception: {e}", exc_info=True)
         return jsonify({'status': 'error', 'message': str(e)})
 
+def cached_conversion(url, output_id):
+    # The finished result for url straight from the on-disk cache (its audio placed at
+    # output_id), or None on a miss
+    video_id = extract_video_id(url)
+    result = result_cache.get(video_id, audio_path(output_id))
+    if result is None:
+        if video_id:
+            CACHE_LOOKUPS.labels('miss').inc()
+        return None
+    CACHE_LOOKUPS.labels('hit').inc()
+    result['cached'] = True
+    result['path'] = 'cache'
+    # Stage timings belong to the run that filled the cache, not to this request
+    result['timings'] = {}
+    fmt = result.get('screenshot_format')
+    if not (fmt and result_cache.restore_screenshot(video_id, screenshot_path(output_id, fmt))):
+        result['screenshot_format'] = None
+    result['screenshot_url'] = f'/screenshot/{output_id}' if result['screenshot_format'] else None
+    result['video_id'] = video_id
+    result['audio_url'] = f'/audio/{output_id}'
+    return result
+
+def convert_with_cache(url, output_id, convert, lookup=True):
+    # `convert(output_id)` runs the browser pipeline; finished audio is cached by
+    # video id, so repeat conversions skip the browser entirely. `lookup=False` is for
+    # callers that already checked the cache.
+    prune_spool()
+    start_time = time.time()
+    video_id = extract_video_id(url)
+
+    result = cached_conversion(url, output_id) if lookup else None
+    if result is None:
+        logging.info(f"Processing URL: {url} on {get_site().host} ({output_id})")
+        try:
+            result = convert(output_id)
+        except Exception:
+            record_job('error', time.time() - start_time)
+            raise
+        observe_stages(result['timings'])
+        observe_download(result.get('download'))
+        result['cached'] = False
+        if result['audio_downloaded']:
+            screenshot_source = screenshot_path(output_id, result['screenshot_format']) if result['screenshot_format'] else None
+            result_cache.put(video_id, audio_path(output_id), result, screenshot_source)
+
+    result['video_id'] = video_id
+    result['audio_url'] = f'/audio/{output_id}' if result['audio_downloaded'] else None
+    record_job(job_outcome(result), time.time() - start_time)
+    return result
+
+def convert_job(url, output_id, screenshot_options, progress=None, pool=None):
+    # Replays the converter's API without a browser when a recipe is known, and
+    # falls back to the browser pipeline if that fails. With hedging on, the browser
+    # run may spread over several converter sites. `pool` is the shared browser pool
+    # unless a batch brings its own browser.
+    pool = pool or browser_pool
+    path = 'browser'
+    if FAST_PATH_ENABLED:
+        try:
+            result = convert_without_browser(url, output_id, progress=progress)
+            if result is not None:
+                result['path'] = 'http'
+                CONVERSION_PATHS.labels('http').inc()
+                return result
+        except FastPathError as e:
+            logging.warning(f"⚡ Fast path failed ({e}), falling back to the browser")
+            path = 'browser_fallback'
+    if CONVERTER_HEDGING:
+        result = convert_hedged(pool, url, output_id, screenshot_options, progress=progress,
+                                timeout=CONVERSION_TIMEOUT)
+    else:
+        result = pool.run(run_conversion, url, output_id, screenshot_options, timeout=CONVERSION_TIMEOUT,
+                                  progress=progress, on_abandon=lambda: discard_audio(output_id))
+    result['path'] = path
+    CONVERSION_PATHS.labels(path).inc()
+    return result
+
+def process_job(job):
+    screenshot_options = resolve_screenshot_options(job.options.get('screenshot'))
+    # /navigate already looked the video up in the result cache
+    return convert_with_cache(job.url, job.id, lambda output_id: convert_job(
+        job.url, output_id, screenshot_options, progress=job.emit
+    ), lookup=False)
+
+def convert_batch_item(url, screenshot_options, batch_browser):
+    # Batch items get their own output id so each result is served from /audio/<id>,
+    # and convert exactly like single jobs, only on the batch's own browser
+    return convert_with_cache(url, uuid.uuid4().hex, lambda output_id: convert_job(
+        url, output_id, screenshot_options, pool=batch_browser
+    ))
+
+def memory_pressure_response(error):
+    response = jsonify({'status': 'error', 'message': 'The server is low on memory. Please try again shortly.'})
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 503
+
+def normalize_url(url):
+    # Add https:// if no protocol is specified
+    url = url.strip()
+    if not url.startswith(('http://', 'https://')):
+        url = 'https://' + url
+    return url
+
+# Persistent on-disk cache of finished conversions
+result_cache = ResultCache()
+
+# Bounded job queue - HTTP requests only enqueue, background workers do the conversions.
+# New jobs are only admitted (and started) while there is memory headroom.
+job_queue = JobQueue(process_job, concurrency=JOB_CONCURRENCY or browser_pool.size, admission=memory_guard)
+job_queue.start()
+
 @app.route('/navigate', methods=['POST'])
 def navigate_to_url():
-    # Use semaphore to ensure only 1 conversion at a time
-    if not conversion_semaphore.acquire(blocking=False):
-        logging.warning("Conversion already in progress, rejecting new request")
-        return jsonify({'status': 'error', 'message': 'A conversion is already in progress. Please wait.'})
-    
     try:
         data = request.get_json()
         url = data.get('url', '')
@@ -51,253 +193,268 @@ def navigate_to_url():
         if not url:
             return jsonify({'status': 'error', 'message': 'No URL provided'})
         
-        # Add https:// if no protocol is specified
-        if not url.startswith(('http://', 'https://')):
-            url = 'https://' + url
-        
-        logging.info(f"Processing URL: {url} on ezconv.com (semaphore acquired)")
-        
-        with sync_playwright() as p:
-            # Launch with aggressive memory-saving flags (lowest possible footprint)
-            browser = p.chromium.launch(
-                headless=True, 
-                args=[
-                    '--disable-dev-shm-usage',
-                    '--no-sandbox',
-                    '--disable-gpu',
-                    '--disable-software-rasterizer',
-                    '--no-zygote',  # Saves ~200MB when combined with single-process
-                    '--single-process',  # Big memory saver (safe for one tab only)
-                    '--disable-dev-tools',
-                    '--disable-extensions',
-                    '--disable-background-timer-throttling',
-                    '--disable-backgrounding-occluded-windows',
-                    '--disable-renderer-backgrounding',
-                    '--memory-pressure-off',  # Prevent memory pressure checks
-                    '--disable-background-networking',
-                    '--disable-sync',
-                    '--disable-translate',
-                    '--metrics-recording-only',
-                    '--no-first-run',
-                    '--disable-setuid-sandbox'
-                ]
-            )
-            # Create a single page context with optimizations
-            context = browser.new_context(
-                viewport={'width': 1280, 'height': 720},
-                locale='en-US',
-                timezone_id='America/New_York',
-                # Disable animations for faster rendering
-                reduced_motion='reduce'
-            )
-            page = context.new_page()
-            
-            # Block heavy resource types early - global route before navigation
-            logging.info("Setting up global resource blocking to save memory...")
-            page.route("**/*", lambda route: (
-                route.abort() if route.request.resource_type in ["image", "media", "font"]
-                else route.continue_()
-            ))
-            
-            # Navigate to youconvert.org first (increased timeout for slow loads)
-            logging.info("Navigating to youconvert.org...")
-            page.goto("https://youconvert.org/", wait_until='domcontentloaded', timeout=60000)
-            
-            # Wait a bit for any dynamic content to load (reduced from 2s to 1s)
-            page.wait_for_timeout(1000)
-            
-            # Find and click the input box using XPath
-            logging.info("Clicking on input box...")
-            input_xpath = "//input[@id='youtube-url']"
-            input_element = page.locator(f"xpath={input_xpath}")
-            input_element.click()
-
-            # Fill in the URL
-            logging.info(f"Filling in URL: {url}")
-            input_element.fill(url)
-
-            # Wait a moment before clicking convert (reduced from 1s to 500ms)
-            page.wait_for_timeout(500)
-
-            # Click the convert button using XPath
-            logging.info("Clicking convert button...")
-            convert_button_xpath = "//button[@id='convertButton']"
-            convert_button = page.locator(f"xpath={convert_button_xpath}")
-            convert_button.click()
-            
-            # Wait exactly 30 seconds for conversion to complete
-            import time
-            start_time = time.time()
-            logging.info("⏳ Starting 30-second wait for conversion to complete...")
-            
-            # Wait in 1-second intervals to allow for more responsive logging
-            for i in range(30):
-                page.wait_for_timeout(1000)  # Wait 1 second
-                remaining = 30 - (i + 1)
-                if remaining > 0:
-                    logging.info(f"⏳ Conversion in progress... {remaining} seconds remaining")
-                else:
-                    logging.info("⏳ Conversion time complete, checking for download button...")
-            
-            elapsed_time = time.time() - start_time
-            logging.info(f"✅ 30-second wait complete! Actual time elapsed: {elapsed_time:.2f} seconds")
-            
-            # Check for download button after 30 seconds
-            download_button_found = False
-            download_button_clickable = False
-            audio_file_base64 = None
-            download_button_xpath = '//*[@id="downloadButton"]'
-            
-            try:
-                logging.info("🔍 Checking for download button...")
-                download_button = page.locator(f"xpath={download_button_xpath}")
-                
-                # Check if button exists and is visible
-                if download_button.is_visible(timeout=2000):
-                    download_button_found = True
-                    logging.info("✅ Download button found and visible!")
-                    
-                    # Check if button is clickable (enabled)
-                    try:
-                        if download_button.is_enabled():
-                            download_button_clickable = True
-                            logging.info("✅ Download button is clickable!")
-                            
-                            # Try to get the download URL from href attribute
-                            try:
-                                download_url = download_button.get_attribute('href')
-                                if download_url:
-                                    logging.info(f"🎵 Found download URL: {download_url[:100]}...")
-                                    
-                                    # Download using requests
-                                    import requests
-                                    logging.info("📥 Downloading audio file...")
-                                    response = requests.get(download_url, timeout=60)
-                                    
-                                    if response.status_code == 200:
-                                        audio_bytes = response.content
-                                        audio_file_base64 = base64.b64encode(audio_bytes).decode('utf-8')
-                                        logging.info(f"✅ Audio file downloaded and encoded! Size: {len(audio_bytes)} bytes")
-                                    else:
-                                        logging.warning(f"❌ Download failed with status code: {response.status_code}")
-                                else:
-                                    logging.info("⚠️ No href attribute found, button might trigger JS download")
-                            except Exception as download_error:
-                                logging.warning(f"⚠️ Could not download via href: {download_error}")
-                                
-                        else:
-                            logging.info("❌ Download button found but NOT clickable")
-                    except Exception as click_check_error:
-                        logging.warning(f"Error checking if button is clickable: {click_check_error}")
-                        download_button_clickable = False
-                else:
-                    logging.info("❌ Download button not visible")
-                    
-            except Exception as button_error:
-                logging.warning(f"Error checking for download button: {button_error}")
-                
-                # Try alternative XPath patterns
-                alternative_patterns = [
-                    '//button[@id="downloadButton"]',
-                    '//a[@id="downloadButton"]',
-                    '//*[contains(@class, "download")]',
-                    '//button[contains(text(), "Download")]',
-                    '//a[contains(text(), "Download")]',
-                    '//*[contains(@class, "btn-download")]'
-                ]
-                
-                logging.info("🔍 Trying alternative XPath patterns...")
-                for pattern in alternative_patterns:
-                    try:
-                        alt_button = page.locator(f"xpath={pattern}")
-                        if alt_button.is_visible(timeout=1000):
-                            download_button_found = True
-                            logging.info(f"✅ Found download button with pattern: {pattern}")
-                            
-                            # Check if clickable
-                            try:
-                                if alt_button.is_enabled():
-                                    download_button_clickable = True
-                                    logging.info("✅ Alternative download button is clickable!")
-                                else:
-                                    logging.info("❌ Alternative download button found but NOT clickable")
-                            except:
-                                download_button_clickable = False
-                            break
-                    except:
-                        continue
-                
-                if not download_button_found:
-                    logging.info("❌ No download button found with any pattern")
-            
-            # NOW take the screenshot of whatever is on the page
-            logging.info("📸 Taking screenshot NOW...")
-            screenshot_bytes = page.screenshot(
-                full_page=False,
-                timeout=20000,
-                animations='disabled'
-            )
-            screenshot_size = len(screenshot_bytes)
-            logging.info(f"✅ Screenshot captured successfully! Size: {screenshot_size} bytes")
-            
-            # Convert screenshot to base64
-            screenshot_base64 = base64.b64encode(screenshot_bytes).decode('utf-8')
-            
-            # Explicit cleanup - ensure resources are freed even if errors occur
-            try:
-                page.close()
-                logging.info("Page closed")
-            except Exception as cleanup_error:
-                logging.warning(f"Error closing page: {cleanup_error}")
-            
-            try:
-                context.close()
-                logging.info("Context closed")
-            except Exception as cleanup_error:
-                logging.warning(f"Error closing context: {cleanup_error}")
-            
-            try:
-                browser.close()
-                logging.info("Browser closed, memory cleaned up")
-            except Exception as cleanup_error:
-                logging.warning(f"Error closing browser: {cleanup_error}")
-        
-        # Prepare status message based on download button findings
-        if download_button_found:
-            if download_button_clickable:
-                status_message = f'✅ SUCCESS! Download button found and clickable!'
-            else:
-                status_message = f'⚠️ Download button found but NOT clickable'
-        else:
-            status_message = f'❌ Download button NOT found'
+        url = normalize_url(url)
+        try:
+            resolve_screenshot_options(data.get('screenshot'))
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
         
-        logging.info(f'Processed {url} on youconvert.org - Button found: {download_button_found}, Clickable: {download_button_clickable}')
+        # Cache hits are answered right here - no queue slot, no memory admission, no waiting
+        # behind browser conversions
+        prune_spool()
+        start_time = time.time()
+        output_id = uuid.uuid4().hex
+        result = cached_conversion(url, output_id)
+        if result is not None:
+            record_job(job_outcome(result), time.time() - start_time)
+            job = job_queue.add_finished(url, result, job_id=output_id)
+            return jsonify({
+                'status': 'done',
+                'message': 'Served from the conversion cache',
+                'job_id': job.id,
+                'result': result,
+                'status_url': url_for('get_job', job_id=job.id),
+                'events_url': url_for('get_job_events', job_id=job.id)
+            })
+
+        # Requests for the same video share one job (single-flight)
+        job = job_queue.submit(url, key=extract_video_id(url) or url, options={'screenshot': data.get('screenshot')})
+        if job.waiters > 1:
+            COALESCED.inc()
         return jsonify({
-            'status': 'success',
-            'message': status_message,
-            'screenshot': screenshot_base64,
-            'download_button_found': download_button_found,
-            'download_button_clickable': download_button_clickable,
-            'audio_file': audio_file_base64
-        })
+            'status': 'queued',
+            'message': 'Conversion queued' if job.waiters == 1 else 'Joined an in-progress conversion of the same video',
+            'job_id': job.id,
+            'position': job_queue.position(job),
+            'waiters': job.waiters,
+            'status_url': url_for('get_job', job_id=job.id),
+            'events_url': url_for('get_job_events', job_id=job.id)
+        }), 202
             
+    except MemoryPressureError as e:
+        logging.warning(f"Shedding new request: {e}")
+        REJECTIONS.labels('memory_pressure').inc()
+        return memory_pressure_response(e)
+    except QueueFullError as e:
+        logging.warning(f"Rejecting new request: {e}")
+        REJECTIONS.labels('queue_full').inc()
+        return jsonify({'status': 'error', 'message': 'Too many conversions queued. Please try again shortly.'}), 503
     except Exception as e:
-        logging.error(f"Error during navigation: {e}", exc_info=True)
+        logging.error(f"Error queueing conversion: {e}", exc_info=True)
         return jsonify({'status': 'error', 'message': str(e)})
-    finally:
-        # Always release the semaphore
-        conversion_semaphore.release()
-        logging.info("Semaphore released, ready for next conversion")
+
+@app.route('/batch', methods=['POST'])
+def batch_convert():
+    data = request.get_json() or {}
+    urls = data.get('urls')
+    if not isinstance(urls, list) or not urls or not all(isinstance(u, str) and u.strip() for u in urls):
+        return jsonify({'status': 'error', 'message': 'Provide a non-empty list of URLs in "urls"'}), 400
+    if len(urls) > BATCH_MAX_URLS:
+        return jsonify({'status': 'error', 'message': f'At most {BATCH_MAX_URLS} URLs per batch'}), 400
+    try:
+        parallelism = int(data.get('parallelism', BATCH_PARALLELISM))
+    except (TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'parallelism must be a number'}), 400
+    parallelism = max(1, min(parallelism, BATCH_MAX_PARALLELISM))
+    try:
+        screenshot_options = resolve_screenshot_options(data.get('screenshot'))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    try:
+        # A batch runs its own browser with `parallelism` pages open at once
+        memory_guard.check(estimate=memory_guard.job_estimate * (parallelism + 1))
+    except MemoryPressureError as e:
+        logging.warning(f"Shedding batch: {e}")
+        REJECTIONS.labels('memory_pressure').inc()
+        return memory_pressure_response(e)
+
+    if not batch_semaphore.acquire(blocking=False):
+        logging.warning("Batch already in progress, rejecting new batch")
+        REJECTIONS.labels('batch_busy').inc()
+        return jsonify({'status': 'error', 'message': 'A batch is already in progress. Please wait.'}), 503
+
+    urls = [normalize_url(u) for u in urls]
+    logging.info(f"📦 Starting batch of {len(urls)} URLs with parallelism {parallelism}")
+
+    def generate():
+        # One JSON object per line, streamed as each item finishes
+        start_time = time.time()
+        succeeded = 0
+        failed = 0
+        try:
+            with BatchBrowser(parallelism) as batch_browser:
+                for index, url, result, error in run_batch(
+                        urls, lambda url: convert_batch_item(url, screenshot_options, batch_browser), parallelism):
+                    if error is None:
+                        succeeded += 1
+                        line = {'index': index, 'url': url, 'status': 'success', 'result': result}
+                    else:
+                        failed += 1
+                        logging.warning(f"Batch item {index} ({url}) failed: {error}")
+                        line = {'index': index, 'url': url, 'status': 'error',
+                                'message': str(error) or error.__class__.__name__}
+                    yield json.dumps(line) + '\n'
+        except Exception as e:
+            logging.error(f"Batch aborted: {e}", exc_info=True)
+            yield json.dumps({'status': 'error', 'message': str(e)}) + '\n'
+        finally:
+            batch_semaphore.release()
+            elapsed = time.time() - start_time
+            logging.info(f"📦 Batch finished in {elapsed:.2f}s - {succeeded} succeeded, {failed} failed")
+        yield json.dumps({'summary': {
+            'total': len(urls),
+            'succeeded': succeeded,
+            'failed': failed,
+            'elapsed': round(elapsed, 2)
+        }}) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'message': 'Unknown or expired job'}), 404
+    data = job.to_dict(position=job_queue.position(job))
+    if job.status == 'failed' and find_screenshot(job.id):
+        # Failed runs still leave their (deferred) screenshot behind for debugging
+        data['screenshot_url'] = f'/screenshot/{job.id}'
+    return jsonify(data)
+
+@app.route('/jobs/<job_id>/events')
+def get_job_events(job_id):
+    # Server-Sent Events: replays the job's progress so far, then pushes each stage
+    # (queued, started, launching, page_loaded, converting, hedge, download) as it happens
+    # and ends with done, failed or cancelled
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'message': 'Unknown or expired job'}), 404
+    try:
+        last_id = int(request.headers.get('Last-Event-ID') or request.args.get('after') or 0)
+    except ValueError:
+        last_id = 0
+    if job.events and job.events[-1]['stage'] in FINISHED_STATES and last_id >= len(job.events):
+        # The client already has the final event; 204 stops EventSource from reconnecting
+        return Response(status=204)
+    if not events_semaphore.acquire(blocking=False):
+        REJECTIONS.labels('events_busy').inc()
+        return jsonify({'status': 'error', 'message': 'Too many open event streams, poll the status URL instead'}), 503
+
+    def generate(last_id):
+        deadline = time.time() + EVENTS_MAX_STREAM_SECONDS
+        # Tell EventSource to reconnect quickly when we close the stream early
+        yield 'retry: 1000\n\n'
+        while time.time() < deadline:
+            events = job.events_after(last_id, timeout=min(EVENTS_KEEPALIVE, max(deadline - time.time(), 0)))
+            if not events:
+                yield ': keep-alive\n\n'
+                continue
+            for event in events:
+                last_id = event['id']
+                yield f"id: {event['id']}\nevent: {event['stage']}\ndata: {json.dumps(event)}\n\n"
+                if event['stage'] in FINISHED_STATES:
+                    return
+
+    response = Response(stream_with_context(generate(last_id)), mimetype='text/event-stream')
+    # Runs once the stream ends or the client goes away, even if it never started
+    response.call_on_close(events_semaphore.release)
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop reverse proxies from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    if job_queue.get(job_id) is None:
+        return jsonify({'status': 'error', 'message': 'Unknown or expired job'}), 404
+    if not job_queue.cancel(job_id):
+        return jsonify({'status': 'error', 'message': 'Job already started and cannot be cancelled'}), 409
+    return jsonify({'status': 'cancelled', 'job_id': job_id})
+
+@app.route('/audio/<job_id>')
+def get_audio(job_id):
+    # Job ids are uuid4 hex strings - refuse anything else so it can't escape the spool directory
+    if not re.fullmatch(r'[0-9a-f]{32}', job_id):
+        return jsonify({'status': 'error', 'message': 'Invalid job id'}), 404
+    path = audio_path(job_id)
+    if not os.path.exists(path):
+        return jsonify({'status': 'error', 'message': 'Audio not found or expired'}), 404
+    # conditional=True gives us Range, ETag and If-Modified-Since handling
+    return send_file(path, mimetype='audio/mpeg', conditional=True, download_name=f'{job_id}.mp3')
+
+@app.route('/screenshot/<job_id>')
+def get_screenshot(job_id):
+    if not re.fullmatch(r'[0-9a-f]{32}', job_id):
+        return jsonify({'status': 'error', 'message': 'Invalid job id'}), 404
+    found = find_screenshot(job_id)
+    if found is None:
+        return jsonify({'status': 'error', 'message': 'Screenshot not found or expired'}), 404
+    path, mimetype = found
+    return send_file(path, mimetype=mimetype, conditional=True)
+
+@app.route('/debug/jobs/<job_id>')
+def get_job_diagnostics(job_id):
+    # Traces and HARs kept for this job's slow or failed browser runs (DIAGNOSTICS_ENABLED)
+    if diagnostics is None:
+        return jsonify({'status': 'error', 'message': 'Diagnostics are disabled'}), 404
+    if not re.fullmatch(r'[0-9a-f]{32}', job_id):
+        return jsonify({'status': 'error', 'message': 'Invalid job id'}), 404
+    runs = diagnostics.list(job_id)
+    for run in runs:
+        run['urls'] = {name: url_for('get_diagnostics_file', artifact_id=run['artifact_id'], filename=name)
+                       for name in run['files']}
+    return jsonify({'job_id': job_id, 'runs': runs})
+
+@app.route('/debug/artifacts/<artifact_id>/<filename>')
+def get_diagnostics_file(artifact_id, filename):
+    if diagnostics is None or not ARTIFACT_ID_RE.match(artifact_id):
+        return jsonify({'status': 'error', 'message': 'Artifact not found'}), 404
+    path = diagnostics.file_path(artifact_id, filename)
+    if path is None:
+        return jsonify({'status': 'error', 'message': 'Artifact not found or expired'}), 404
+    return send_file(path, as_attachment=filename == 'trace.zip', conditional=True)
+
+@app.route('/metrics')
+def get_metrics():
+    # Prometheus text format; gauges are sampled at scrape time
+    queue_stats = job_queue.stats()
+    QUEUE_DEPTH.set(queue_stats['queued'])
+    JOBS_RUNNING.set(queue_stats['running'])
+    BROWSERS_HEALTHY.set(browser_pool.health()['healthy'])
+    CACHE_BYTES.set(result_cache.stats()['bytes'])
+    for process, rss in process_tree_rss().items():
+        RSS_BYTES.labels(process).set(rss)
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
 
 @app.route('/status')
 def get_status():
     try:
         logging.info("Checking Playwright Chromium status...")
-        # Lightweight status check - don't actually launch browser to save memory
-        # Just check if Playwright is available
-        from playwright.sync_api import sync_playwright
-        logging.info('Playwright Chromium is functional (status check passed).')
-        return jsonify({'status': 'running', 'message': 'Chromium is functional'})
+        # Health check the warm browser pool (also restarts dead worker threads)
+        pool_health = browser_pool.health()
+        if pool_health['healthy'] > 0:
+            logging.info(f"Chromium pool is functional ({pool_health['healthy']}/{pool_health['size']} browsers healthy).")
+            return jsonify({
+                'status': 'running',
+                'message': f"Chromium is functional ({pool_health['healthy']}/{pool_health['size']} browsers ready)",
+                'pool': pool_health,
+                'queue': job_queue.stats(),
+                'cache': result_cache.stats(),
+                'memory': memory_guard.stats(),
+                'backends': backends.stats()
+            })
+        logging.warning(f"No healthy browsers in pool: {pool_health}")
+        return jsonify({
+            'status': 'stopped',
+            'message': 'Chromium pool is starting or has no healthy browsers',
+            'pool': pool_health,
+            'queue': job_queue.stats(),
+            'cache': result_cache.stats(),
+            'memory': memory_guard.stats(),
+            'backends': backends.stats()
+        })
     except Exception as e:
         logging.warning(f"Playwright Chromium status check failed: {e}")
         return jsonify({'status': 'stopped', 'message': 'Chromium is not functional or check failed: ' + str(e)})
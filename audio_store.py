@@ -0,0 +1,58 @@
+import logging
+import os
+import tempfile
+import time
+
+# Directory converted audio files (and debug screenshots) are spooled to before being served
+AUDIO_SPOOL_DIR = os.environ.get('AUDIO_SPOOL_DIR', os.path.join(tempfile.gettempdir(), 'chromium-launcher-audio'))
+# Spooled files older than this are deleted (matches how long finished jobs are kept)
+AUDIO_RETENTION_SECONDS = float(os.environ.get('AUDIO_RETENTION_SECONDS', os.environ.get('JOB_RESULT_TTL', 600)))
+
+# Screenshot format -> file extension / mimetype
+SCREENSHOT_TYPES = {
+    'png': ('png', 'image/png'),
+    'jpeg': ('jpg', 'image/jpeg'),
+    'webp': ('webp', 'image/webp'),
+}
+
+
+def audio_path(job_id):
+    os.makedirs(AUDIO_SPOOL_DIR, exist_ok=True)
+    return os.path.join(AUDIO_SPOOL_DIR, f'{job_id}.mp3')
+
+
+def screenshot_path(job_id, fmt):
+    os.makedirs(AUDIO_SPOOL_DIR, exist_ok=True)
+    return os.path.join(AUDIO_SPOOL_DIR, f'{job_id}.{SCREENSHOT_TYPES[fmt][0]}')
+
+
+def discard_audio(job_id):
+    # Removes audio that nobody will collect, e.g. written by a run the job gave up on
+    try:
+        os.remove(audio_path(job_id))
+        logging.info(f"🧹 Discarded audio of abandoned run {job_id}")
+    except FileNotFoundError:
+        pass
+
+
+def find_screenshot(job_id):
+    # (path, mimetype) of whichever screenshot format was captured for the job, if any
+    for extension, mimetype in SCREENSHOT_TYPES.values():
+        path = os.path.join(AUDIO_SPOOL_DIR, f'{job_id}.{extension}')
+        if os.path.exists(path):
+            return path, mimetype
+    return None
+
+
+def prune_spool(max_age=AUDIO_RETENTION_SECONDS):
+    if not os.path.isdir(AUDIO_SPOOL_DIR):
+        return
+    cutoff = time.time() - max_age
+    for name in os.listdir(AUDIO_SPOOL_DIR):
+        path = os.path.join(AUDIO_SPOOL_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                logging.info(f"🧹 Removed expired audio file {name}")
+        except OSError as e:
+            logging.warning(f"Could not prune {name}: {e}")
@@ -0,0 +1,232 @@
+import json
+import logging
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the converter site used by the benchmarks. It mirrors the parts of
+# youconvert.org the pipeline touches: #youtube-url, #convertButton, a backend API that
+# takes `delay` seconds to "convert", and a #downloadButton whose href serves a synthetic MP3.
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <title>Fake Converter</title>
+</head>
+<body>
+    <form id="converterForm" onsubmit="return false;">
+        <input type="text" id="youtube-url" placeholder="Paste YouTube URL">
+        <button type="button" id="convertButton">Convert</button>
+        <div id="progress" style="display: none;">Converting...</div>
+        <div id="errorMessage" style="display: none;"></div>
+        <a id="downloadButton" style="display: none;">Download MP3</a>
+    </form>
+    <script>
+        const show = (id, text) => {
+            const el = document.getElementById(id);
+            if (text !== undefined) el.textContent = text;
+            el.style.display = 'block';
+        };
+        document.getElementById('convertButton').addEventListener('click', async () => {
+            const url = document.getElementById('youtube-url').value;
+            show('progress');
+            const started = await fetch('/api/convert', {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({url: url})
+            }).then(r => r.json());
+            if (started.error) {
+                show('errorMessage', started.error);
+                return;
+            }
+            const poll = async () => {
+                const status = await fetch('/api/status/' + started.id).then(r => r.json());
+                if (status.state !== 'ready') {
+                    setTimeout(poll, 200);
+                    return;
+                }
+                const button = document.getElementById('downloadButton');
+                button.href = status.download_url;
+                document.getElementById('progress').style.display = 'none';
+                show('downloadButton');
+            };
+            poll();
+        });
+    </script>
+</body>
+</html>
+"""
+
+# Frame header of a 128 kbps / 44.1 kHz MPEG-1 Layer III frame, 417 bytes long
+MP3_FRAME = b'\xff\xfb\x90\x00' + b'\x00' * 413
+
+
+def synthetic_mp3(size):
+    # An ID3 tag followed by silent frames, truncated to exactly `size` bytes
+    header = b'ID3\x04\x00\x00\x00\x00\x00\x00'
+    frames = MP3_FRAME * (max(size - len(header), 0) // len(MP3_FRAME) + 1)
+    return (header + frames)[:size]
+
+
+class FakeConverter:
+    # Settings are read per request, so the harness can change them between runs
+
+    def __init__(self, host='127.0.0.1', port=0, delay=2.0, payload_size=1024 * 1024, error_rate=0.0):
+        self.delay = delay
+        self.payload_size = payload_size
+        self.error_rate = error_rate
+        self.conversions = {}
+        self.requests = 0
+        self.bytes_served = 0
+        self._lock = threading.Lock()
+        self._payloads = {}
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    def payload(self, size):
+        with self._lock:
+            if size not in self._payloads:
+                self._payloads[size] = synthetic_mp3(size)
+            return self._payloads[size]
+
+    def start_conversion(self, url):
+        with self._lock:
+            self.requests += 1
+            # Deterministic failures: every Nth conversion errors when error_rate is 1/N
+            fails = self.error_rate > 0 and self.requests % max(int(round(1 / self.error_rate)), 1) == 0
+            conversion_id = uuid.uuid4().hex
+            self.conversions[conversion_id] = {
+                'url': url,
+                'ready_at': time.time() + self.delay,
+                'size': self.payload_size,
+                'failed': fails,
+            }
+        return conversion_id, fails
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='fake-converter', daemon=True)
+        self._thread.start()
+        logging.info(f"Fake converter listening on {self.url}")
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler_class(self):
+        converter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body, content_type, headers=None):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(body)
+
+            def _json(self, data, status=200):
+                self._send(status, json.dumps(data).encode('utf-8'), 'application/json')
+
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                if path == '/':
+                    self._send(200, PAGE.encode('utf-8'), 'text/html; charset=utf-8')
+                    return
+                match = re.fullmatch(r'/api/status/([0-9a-f]{32})', path)
+                if match:
+                    conversion = converter.conversions.get(match.group(1))
+                    if conversion is None:
+                        self._json({'error': 'Unknown conversion'}, 404)
+                    elif time.time() < conversion['ready_at']:
+                        self._json({'state': 'converting'})
+                    else:
+                        self._json({'state': 'ready', 'download_url': f'/download/{match.group(1)}.mp3'})
+                    return
+                match = re.fullmatch(r'/download/([0-9a-f]{32})\.mp3', path)
+                if match and match.group(1) in converter.conversions:
+                    self._download(converter.conversions[match.group(1)])
+                    return
+                self._json({'error': 'Not found'}, 404)
+
+            do_HEAD = do_GET
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                if self.path != '/api/convert':
+                    self._json({'error': 'Not found'}, 404)
+                    return
+                try:
+                    url = json.loads(body or b'{}').get('url', '')
+                except ValueError:
+                    url = ''
+                if not url:
+                    self._json({'error': 'Please enter a YouTube URL'}, 400)
+                    return
+                conversion_id, fails = converter.start_conversion(url)
+                if fails:
+                    self._json({'error': 'Conversion failed, please try another video'})
+                    return
+                self._json({'id': conversion_id})
+
+            def _download(self, conversion):
+                payload = converter.payload(conversion['size'])
+                headers = {'Accept-Ranges': 'bytes', 'Content-Disposition': 'attachment; filename="audio.mp3"'}
+                byte_range = re.fullmatch(r'bytes=(\d*)-(\d*)', self.headers.get('Range', ''))
+                if byte_range and (byte_range.group(1) or byte_range.group(2)):
+                    if byte_range.group(1):
+                        start = int(byte_range.group(1))
+                        end = int(byte_range.group(2)) if byte_range.group(2) else len(payload) - 1
+                    else:
+                        start = max(len(payload) - int(byte_range.group(2)), 0)
+                        end = len(payload) - 1
+                    end = min(end, len(payload) - 1)
+                    if start > end:
+                        self._send(416, b'', 'audio/mpeg', {'Content-Range': f'bytes */{len(payload)}'})
+                        return
+                    headers['Content-Range'] = f'bytes {start}-{end}/{len(payload)}'
+                    body = payload[start:end + 1]
+                    status = 206
+                else:
+                    body = payload
+                    status = 200
+                with converter._lock:
+                    converter.bytes_served += len(body)
+                self._send(status, body, 'audio/mpeg', headers)
+
+        return Handler
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Serve the fake converter site on its own')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--delay', type=float, default=2.0, help='Seconds each conversion takes')
+    parser.add_argument('--size', type=int, default=1024 * 1024, help='Bytes in each synthetic MP3')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    fake = FakeConverter(port=args.port, delay=args.delay, payload_size=args.size)
+    logging.info(f"Fake converter listening on {fake.url}")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        fake.server.server_close()
@@ -0,0 +1,264 @@
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import shutil
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# Offline benchmark: starts the fake converter, runs the app against it and drives
+# /navigate + /jobs/<id> at each concurrency level and payload size.
+#
+#   python benchmarks/run.py --concurrency 1,2,4 --sizes 1MB,10MB --jobs 8
+#
+# Extra app settings can be passed through the environment (e.g. BROWSER_POOL_SIZE=2).
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from benchmarks.fake_converter import FakeConverter  # noqa: E402
+from metrics import process_tree_rss  # noqa: E402
+
+SIZE_UNITS = {'kb': 1024, 'mb': 1024 * 1024, 'gb': 1024 * 1024 * 1024, 'b': 1}
+
+
+def parse_size(text):
+    text = text.strip().lower()
+    for unit, factor in SIZE_UNITS.items():
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * factor)
+    return int(text)
+
+
+def format_size(size):
+    for unit, factor in (('MB', 1024 * 1024), ('KB', 1024)):
+        if size >= factor:
+            return f'{size / factor:g}{unit}'
+    return f'{size}B'
+
+
+def percentile(values, pct):
+    # Nearest-rank percentile; None for an empty sample
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100 * len(ordered)), 1)
+    return round(ordered[rank - 1], 3)
+
+
+def random_video_url():
+    # A fresh video id per job so neither the result cache nor single-flight short-circuits it
+    video_id = ''.join(random.choice(string.ascii_letters + string.digits + '-_') for _ in range(11))
+    return f'https://www.youtube.com/watch?v={video_id}'
+
+
+class RssSampler(threading.Thread):
+    # Tracks the peak resident memory of the app process tree between reset() calls
+
+    def __init__(self, pid, interval=0.25):
+        super().__init__(name='rss-sampler', daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = {}
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self.peak = {}
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            sample = process_tree_rss(self.pid)
+            sample['total'] = sum(sample.values())
+            with self._lock:
+                for group, rss in sample.items():
+                    self.peak[group] = max(self.peak.get(group, 0), rss)
+
+    def stop(self):
+        self._done.set()
+
+
+class AppServer:
+    # The app under test, run the way production runs it (gunicorn, one worker)
+
+    def __init__(self, fake, port, threads, work_dir, extra_env=None):
+        self.port = port
+        self.base_url = f'http://127.0.0.1:{port}'
+        sites_file = os.path.join(work_dir, 'sites.json')
+        with open(os.path.join(REPO_DIR, 'sites.json')) as f:
+            site = json.load(f)['youconvert']
+        # Same selectors and timings as the real site, pointed at the local stand-in
+        site['url'] = fake.url
+        with open(sites_file, 'w') as f:
+            json.dump({'fake': site}, f, indent=4)
+
+        self.env = dict(os.environ)
+        self.env.update({
+            'CONVERTER_SITES_FILE': sites_file,
+            'CONVERTER_SITE': 'fake',
+            'AUDIO_SPOOL_DIR': os.path.join(work_dir, 'spool'),
+            'RESULT_CACHE_DIR': os.path.join(work_dir, 'results'),
+            'STATIC_CACHE_DIR': os.path.join(work_dir, 'static'),
+        })
+        self.env.update(extra_env or {})
+        self.command = [
+            sys.executable, '-m', 'gunicorn', 'app:app', '--bind', f'127.0.0.1:{port}',
+            '--workers', '1', '--threads', str(threads), '--timeout', '120',
+        ]
+        self.process = None
+
+    def start(self, ready_timeout=120):
+        self.process = subprocess.Popen(self.command, cwd=REPO_DIR, env=self.env)
+        deadline = time.time() + ready_timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'App exited with code {self.process.returncode} during startup')
+            try:
+                status = requests.get(self.base_url + '/status', timeout=5).json()
+                if status.get('status') == 'running':
+                    return self
+            except (requests.RequestException, ValueError):
+                pass
+            time.sleep(0.5)
+        raise RuntimeError(f'App did not report a healthy browser pool within {ready_timeout}s')
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+def run_job(session, base_url, job_timeout, poll_interval):
+    # Submit one conversion and poll it to completion; returns (latency, outcome)
+    start_time = time.perf_counter()
+    response = session.post(base_url + '/navigate', json={'url': random_video_url()}, timeout=30)
+    if response.status_code == 503:
+        return time.perf_counter() - start_time, 'rejected'
+    data = response.json()
+    if response.status_code != 202:
+        return time.perf_counter() - start_time, 'error'
+
+    deadline = time.time() + job_timeout
+    while time.time() < deadline:
+        job = session.get(base_url + data['status_url'], timeout=30).json()
+        if job.get('status') == 'done':
+            ok = job['result'].get('audio_downloaded')
+            return time.perf_counter() - start_time, 'success' if ok else 'failed'
+        if job.get('status') in ('failed', 'cancelled'):
+            return time.perf_counter() - start_time, 'failed'
+        time.sleep(poll_interval)
+    return time.perf_counter() - start_time, 'timeout'
+
+
+def run_level(app, fake, sampler, concurrency, payload_size, jobs, job_timeout, poll_interval):
+    fake.payload_size = payload_size
+    sampler.reset()
+    latencies = []
+    outcomes = {}
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+    session.mount('http://', adapter)
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(run_job, session, app.base_url, job_timeout, poll_interval) for _ in range(jobs)]
+        for future in futures:
+            try:
+                latency, outcome = future.result()
+            except Exception as e:
+                logging.warning(f"Benchmark request failed: {e}")
+                latency, outcome = None, 'error'
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+            if outcome == 'success':
+                latencies.append(latency)
+    elapsed = time.perf_counter() - start_time
+
+    return {
+        'concurrency': concurrency,
+        'payload_bytes': payload_size,
+        'jobs': jobs,
+        'outcomes': outcomes,
+        'elapsed': round(elapsed, 2),
+        'throughput': round(outcomes.get('success', 0) / elapsed, 3) if elapsed else 0,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'peak_rss': dict(sampler.peak),
+    }
+
+
+def print_report(results):
+    header = f"{'conc':>4} {'payload':>8} {'ok/jobs':>8} {'jobs/s':>7} {'p50':>7} {'p95':>7} {'p99':>7} {'peak RSS':>9}"
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        latency = ' '.join(f'{r[p]:>6.2f}s' if r[p] is not None else f"{'-':>7}" for p in ('p50', 'p95', 'p99'))
+        print(f"{r['concurrency']:>4} {format_size(r['payload_bytes']):>8} "
+              f"{r['outcomes'].get('success', 0):>3}/{r['jobs']:<4} {r['throughput']:>7.3f} {latency} "
+              f"{r['peak_rss'].get('total', 0) / (1024 * 1024):>7.0f}MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the converter service against a local fake converter')
+    parser.add_argument('--concurrency', default='1,2,4', help='Comma-separated client concurrency levels')
+    parser.add_argument('--sizes', default='1MB', help='Comma-separated synthetic MP3 sizes (e.g. 512KB,5MB)')
+    parser.add_argument('--jobs', type=int, default=0, help='Jobs per run (default: 4 x concurrency)')
+    parser.add_argument('--delay', type=float, default=2.0, help='Seconds the fake converter takes per conversion')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of conversions the fake site fails')
+    parser.add_argument('--threads', type=int, default=8, help='gunicorn threads for the app')
+    parser.add_argument('--port', type=int, default=5055, help='Port for the app under test')
+    parser.add_argument('--job-timeout', type=float, default=300)
+    parser.add_argument('--poll-interval', type=float, default=0.1)
+    parser.add_argument('--json', dest='json_path', help='Also write the results to this file')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    levels = [int(c) for c in args.concurrency.split(',')]
+    sizes = [parse_size(s) for s in args.sizes.split(',')]
+    # Leave room for every job of the busiest run so the queue limit doesn't skew results
+    max_jobs = max(args.jobs or 4 * c for c in levels)
+
+    work_dir = tempfile.mkdtemp(prefix='converter-bench-')
+    fake = FakeConverter(delay=args.delay, error_rate=args.error_rate).start()
+    app = AppServer(fake, args.port, args.threads, work_dir, extra_env={
+        'JOB_QUEUE_SIZE': os.environ.get('JOB_QUEUE_SIZE', str(max_jobs)),
+    })
+    results = []
+    try:
+        app.start()
+        sampler = RssSampler(app.process.pid)
+        sampler.start()
+        for size in sizes:
+            for concurrency in levels:
+                jobs = args.jobs or 4 * concurrency
+                logging.info(f"Running {jobs} jobs at concurrency {concurrency} with {format_size(size)} payloads")
+                results.append(run_level(app, fake, sampler, concurrency, size, jobs,
+                                         args.job_timeout, args.poll_interval))
+        sampler.stop()
+    finally:
+        app.stop()
+        fake.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_report(results)
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({'delay': args.delay, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
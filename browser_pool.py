@@ -0,0 +1,490 @@
+import itertools
+import logging
+import os
+import queue
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
+from multiprocessing.connection import Connection
+
+from browser_worker import BROWSER_MAX_RSS_BYTES
+from memory_guard import memory_guard
+from metrics import STAGE_SECONDS
+
+# Number of browser worker processes (one warm Chromium each); 0 sizes the pool
+# from the available cores and memory
+BROWSER_POOL_SIZE = int(os.environ.get('BROWSER_POOL_SIZE', 0))
+# Memory one worker process needs with its Chromium, used when sizing the pool automatically
+BROWSER_WORKER_MEMORY = int(os.environ.get('BROWSER_WORKER_MEMORY', 350 * 1024 * 1024))
+# Recycle a browser after this many jobs to cap slow memory growth
+BROWSER_MAX_JOBS = int(os.environ.get('BROWSER_MAX_JOBS', 20))
+# How often an idle worker checks that its browser is still alive
+BROWSER_HEALTH_INTERVAL = float(os.environ.get('BROWSER_HEALTH_INTERVAL', 5))
+# A worker that spends longer than this on one task is killed and restarted
+BROWSER_TASK_TIMEOUT = float(os.environ.get('BROWSER_TASK_TIMEOUT', 150))
+
+# Number of contexts a /batch request keeps busy at once in its shared browser
+BATCH_PARALLELISM = int(os.environ.get('BATCH_PARALLELISM', 3))
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class BrowserWorkerError(Exception):
+    pass
+
+
+def default_pool_size():
+    # One worker per core, as long as each one fits in the memory we are allowed to use
+    by_cpu = os.cpu_count() or 1
+    if not memory_guard.limit:
+        return 1
+    by_memory = int(memory_guard.limit * memory_guard.admit_fraction) // BROWSER_WORKER_MEMORY
+    return max(1, min(by_cpu, by_memory))
+
+
+class BrowserWorker(threading.Thread):
+    # Web-process side of one browser worker. Playwright runs in a separate
+    # `python -m browser_worker` process so a slow or crashing browser never blocks
+    # the web tier; this thread feeds it tasks over a socketpair and restarts it
+    # when it dies.
+
+    def __init__(self, pool, index):
+        super().__init__(name=f'browser-worker-{index}', daemon=True)
+        self.pool = pool
+        self.index = index
+        self.process = None
+        self.restarts = 0
+        self.last_error = None
+        self.worker_health = {'state': 'starting', 'connected': False, 'launches': 0}
+        # Future of the task the worker process is running right now, and whether the web
+        # process has since given up on it (its late progress reports are dropped)
+        self.current = None
+        self.current_cancelled = False
+        self._conn = None
+        self._send_lock = threading.Lock()
+        self._observed_launches = 0
+        # Standby site last announced to the current worker process
+        self._standby_site = None
+
+    def _spawn(self):
+        parent_sock, child_sock = socket.socketpair()
+        try:
+            self.process = subprocess.Popen(
+                [sys.executable, '-m', 'browser_worker', str(child_sock.fileno()), self.name, str(self.pool.max_jobs)],
+                cwd=APP_DIR, pass_fds=(child_sock.fileno(),)
+            )
+        finally:
+            child_sock.close()
+        self._conn = Connection(parent_sock.detach())
+        self.worker_health = {'state': 'starting', 'connected': False, 'launches': 0}
+        self._observed_launches = 0
+        self._standby_site = None
+        logging.info(f"[{self.name}] Started worker process {self.process.pid}")
+
+    def _stop_process(self):
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            try:
+                with self._send_lock:
+                    self._conn.send(('stop',))
+            except OSError:
+                pass
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        try:
+            self._conn.close()
+        except OSError:
+            pass
+        self.process = None
+        self._conn = None
+        self.worker_health = dict(self.worker_health, state='stopped', connected=False)
+
+    def _ensure_process(self):
+        if self.process is not None and self.process.poll() is None:
+            return
+        if self.process is not None:
+            logging.warning(f"⚠️ [{self.name}] Worker process exited with code {self.process.returncode}, restarting")
+            self._stop_process()
+            self.restarts += 1
+            # Back off a little so a worker that dies on startup doesn't spin
+            self.pool.stopping.wait(min(self.restarts, BROWSER_HEALTH_INTERVAL))
+        self._spawn()
+
+    def _update_health(self, health):
+        self.worker_health = health
+        # Launches happen in the worker process; their timings are recorded here
+        if health['launches'] > self._observed_launches and health['last_launch_seconds'] is not None:
+            STAGE_SECONDS.labels('browser_launch').observe(health['last_launch_seconds'])
+        self._observed_launches = health['launches']
+
+    def _call(self, message, timeout, progress=None):
+        # Sends one request and waits for the reply, watching the process while we wait.
+        # Progress events that arrive in the meantime are handed to `progress`.
+        start_time = time.time()
+        try:
+            with self._send_lock:
+                self._conn.send(message)
+            while True:
+                while not self._conn.poll(1):
+                    if self.process.poll() is not None:
+                        raise BrowserWorkerError(f'Browser worker exited with code {self.process.returncode}')
+                    if time.time() - start_time > timeout:
+                        logging.error(f"[{self.name}] Worker unresponsive for {timeout:.0f}s, killing it")
+                        self.process.kill()
+                        self.process.wait()
+                        raise BrowserWorkerError(f'Browser worker did not respond within {timeout:.0f}s')
+                kind, payload, health = self._conn.recv()
+                if kind != 'progress':
+                    break
+                if progress is not None and not self.current_cancelled:
+                    stage, data = payload
+                    try:
+                        progress(stage, **data)
+                    except Exception as e:
+                        logging.warning(f"[{self.name}] Progress callback failed: {e}")
+        except (EOFError, OSError) as e:
+            # The next loop iteration notices the dead process and restarts it
+            self.process.kill()
+            self.process.wait()
+            raise BrowserWorkerError(f'Lost connection to browser worker: {e}')
+        self._update_health(health)
+        if kind == 'error':
+            raise BrowserWorkerError(payload)
+        return payload
+
+    def run(self):
+        try:
+            while not self.pool.stopping.is_set():
+                self._ensure_process()
+                self._announce_standby_site()
+                try:
+                    item = self.pool.tasks.get(timeout=BROWSER_HEALTH_INTERVAL)
+                except queue.Empty:
+                    try:
+                        self._call(('health',), timeout=BROWSER_TASK_TIMEOUT)
+                    except BrowserWorkerError as e:
+                        self.last_error = str(e)
+                    continue
+
+                if item is None:
+                    # Shutdown sentinel
+                    break
+
+                (func, args, progress), future = item
+                if not future.set_running_or_notify_cancel():
+                    continue
+                with self._send_lock:
+                    self.current = future
+                    self.current_cancelled = False
+                try:
+                    result = self._call(('run', func, args), timeout=BROWSER_TASK_TIMEOUT, progress=progress)
+                except Exception as e:
+                    self.last_error = str(e)
+                    error = e
+                else:
+                    error = None
+                # Cleared before the next task is sent, so a late cancel can't hit it
+                with self._send_lock:
+                    self.current = None
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+        finally:
+            self._stop_process()
+
+    def _announce_standby_site(self):
+        # Only sent between tasks - while one runs the worker expects nothing but 'cancel'
+        site_name = self.pool.standby_site
+        if site_name is None or site_name == self._standby_site:
+            return
+        try:
+            with self._send_lock:
+                self._conn.send(('standby', site_name))
+        except OSError:
+            return
+        self._standby_site = site_name
+
+    def cancel(self, future):
+        # Asks the worker process to abandon `future`'s task at its next progress report or checkpoint
+        with self._send_lock:
+            if self.current is not future or self._conn is None:
+                return False
+            try:
+                self._conn.send(('cancel',))
+            except OSError:
+                return False
+            self.current_cancelled = True
+        return True
+
+    def health(self):
+        alive = self.process is not None and self.process.poll() is None
+        return dict(self.worker_health, **{
+            'name': self.name,
+            'pid': self.process.pid if self.process is not None else None,
+            'alive': self.is_alive() and alive,
+            'connected': alive and self.worker_health.get('connected', False),
+            'restarts': self.restarts,
+            'last_error': self.worker_health.get('last_error') or self.last_error,
+        })
+
+
+class TaskRunner:
+    # run() on top of submit()/cancel(), shared by the pool and the batch browser
+
+    def run(self, func, *args, timeout=None, progress=None, on_abandon=None):
+        # `on_abandon()` is called once a task given up on after `timeout` has stopped,
+        # to clean up whatever it still produced
+        future = self.submit(func, *args, progress=progress)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            # Don't let a job that never got a browser run later for nobody, and stop one
+            # that is still running at its next checkpoint
+            self.cancel(future)
+            if on_abandon is not None:
+                future.add_done_callback(lambda _future: on_abandon())
+            raise
+
+
+class BrowserPool(TaskRunner):
+    # Long-lived pool of warm Chromium browsers, each in its own worker process.
+    # Tasks are module-level functions called as func(context, *args) inside a
+    # worker with a fresh browser context, or with the worker's standby converter page
+    # (func(context, *args, standby=...)) when the task accepts one. Arguments and
+    # results must be picklable. A task that accepts `progress` can report stages,
+    # which reach the optional `progress` callback given to submit()/run() here.
+
+    def __init__(self, size=BROWSER_POOL_SIZE, max_jobs=BROWSER_MAX_JOBS):
+        self.size = max(1, size or default_pool_size())
+        self.max_jobs = max(1, max_jobs)
+        self.tasks = queue.Queue()
+        self.stopping = threading.Event()
+        # Converter site the workers keep standby pages for (None: the configured CONVERTER_SITE)
+        self.standby_site = None
+        self._workers = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._workers:
+                return
+            logging.info(f"Starting browser pool with {self.size} worker process(es), recycling every {self.max_jobs} jobs")
+            for index in range(self.size):
+                worker = BrowserWorker(self, index)
+                worker.start()
+                self._workers.append(worker)
+
+    def _revive_dead_workers(self):
+        with self._lock:
+            for position, worker in enumerate(self._workers):
+                if not worker.is_alive() and not self.stopping.is_set():
+                    logging.warning(f"⚠️ {worker.name} died, starting a replacement")
+                    replacement = BrowserWorker(self, worker.index)
+                    replacement.start()
+                    self._workers[position] = replacement
+
+    def submit(self, func, *args, progress=None):
+        self.start()
+        self._revive_dead_workers()
+        future = Future()
+        self.tasks.put(((func, args, progress), future))
+        return future
+
+    def cancel(self, future):
+        # Drops a task that hasn't started yet, or interrupts it at its next checkpoint
+        if future.cancel():
+            return True
+        return any(worker.cancel(future) for worker in self._workers)
+
+    def set_standby_site(self, site_name):
+        # Workers switch their standby pages over before their next task
+        self.standby_site = site_name
+
+    def idle(self):
+        # Workers free to take a task right now
+        busy = sum(1 for worker in self._workers if worker.current is not None)
+        return max(0, len(self._workers) - busy - self.tasks.qsize())
+
+    def health(self):
+        self._revive_dead_workers()
+        workers = [worker.health() for worker in self._workers]
+        healthy = sum(1 for w in workers if w['alive'] and w['connected'])
+        return {
+            'size': self.size,
+            'healthy': healthy,
+            'pending': self.tasks.qsize(),
+            'max_jobs_per_browser': self.max_jobs,
+            'max_rss_per_browser': BROWSER_MAX_RSS_BYTES,
+            'workers': workers,
+        }
+
+    def shutdown(self, timeout=10):
+        self.stopping.set()
+        for _ in self._workers:
+            self.tasks.put(None)
+        for worker in self._workers:
+            worker.join(timeout=timeout)
+
+
+class BatchBrowser(TaskRunner):
+    # One multi-process Chromium for a /batch request, in its own `python -m browser_worker`
+    # process (see browser_worker.serve_shared), running up to `slots` tasks at once in
+    # separate contexts. Has the pool's submit/run/cancel/idle interface, so conversions
+    # (hedged or not) run on it exactly as they do on the pool. Use as a context manager.
+
+    def __init__(self, slots, name='batch-browser', max_jobs=BROWSER_MAX_JOBS):
+        self.slots = max(1, slots)
+        self.name = name
+        self.max_jobs = max_jobs
+        self.process = None
+        self._conn = None
+        self._reader = None
+        self._send_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        # task id -> (future, progress callback); ids of tasks the web side gave up on
+        self._pending = {}
+        self._cancelled = set()
+        self._exited = False
+
+    def start(self):
+        parent_sock, child_sock = socket.socketpair()
+        try:
+            self.process = subprocess.Popen(
+                [sys.executable, '-m', 'browser_worker', str(child_sock.fileno()), self.name, str(self.max_jobs),
+                 str(self.slots)],
+                cwd=APP_DIR, pass_fds=(child_sock.fileno(),)
+            )
+        finally:
+            child_sock.close()
+        self._conn = Connection(parent_sock.detach())
+        self._reader = threading.Thread(target=self._read, name=f'{self.name}-reader', daemon=True)
+        self._reader.start()
+        logging.info(f"📦 Started batch browser process {self.process.pid} with {self.slots} slot(s)")
+
+    def _read(self):
+        while True:
+            try:
+                kind, task_id, payload = self._conn.recv()
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                future, progress = self._pending.get(task_id, (None, None))
+                abandoned = task_id in self._cancelled
+                if kind != 'progress':
+                    self._pending.pop(task_id, None)
+                    self._cancelled.discard(task_id)
+            if future is None:
+                continue
+            if kind == 'progress':
+                if progress is not None and not abandoned:
+                    stage, data = payload
+                    try:
+                        progress(stage, **data)
+                    except Exception as e:
+                        logging.warning(f"[{self.name}] Progress callback failed: {e}")
+            elif kind == 'result':
+                future.set_result(payload)
+            else:
+                future.set_exception(BrowserWorkerError(payload))
+        # The process is gone - nothing still pending will get an answer
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._exited = True
+        for future, _ in pending.values():
+            future.set_exception(BrowserWorkerError('Batch browser exited'))
+
+    def submit(self, func, *args, progress=None):
+        future = Future()
+        future.set_running_or_notify_cancel()
+        task_id = next(self._ids)
+        with self._lock:
+            if self._exited:
+                future.set_exception(BrowserWorkerError('Batch browser exited'))
+                return future
+            self._pending[task_id] = (future, progress)
+        try:
+            with self._send_lock:
+                self._conn.send(('run', task_id, func, args))
+        except OSError as e:
+            with self._lock:
+                self._pending.pop(task_id, None)
+            future.set_exception(BrowserWorkerError(f'Batch browser is not running: {e}'))
+        return future
+
+    def cancel(self, future):
+        with self._lock:
+            task_id = next((task_id for task_id, (pending, _) in self._pending.items() if pending is future), None)
+            if task_id is None:
+                return False
+            self._cancelled.add(task_id)
+        try:
+            with self._send_lock:
+                self._conn.send(('cancel', task_id))
+        except OSError:
+            return False
+        return True
+
+    def idle(self):
+        with self._lock:
+            return max(0, self.slots - len(self._pending))
+
+    def set_standby_site(self, site_name):
+        # Batch contexts are always fresh - there are no standby pages to switch
+        pass
+
+    def stop(self, timeout=30):
+        if self.process is None:
+            return
+        # Whatever is still running belongs to a client that went away
+        with self._lock:
+            pending = [future for future, _ in self._pending.values()]
+        for future in pending:
+            self.cancel(future)
+        try:
+            with self._send_lock:
+                self._conn.send(('stop',))
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self._conn.close()
+        self._reader.join(timeout=5)
+        self.process = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def run_batch(items, task, parallelism=BATCH_PARALLELISM):
+    # Calls task(item) for every item from `parallelism` threads. Tasks hand their browser
+    # work to a worker process (see BatchBrowser). Yields (index, item, result, error) in
+    # completion order; one failing item never stops the others.
+    parallelism = max(1, min(parallelism, len(items)))
+    executor = ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix='batch')
+    try:
+        futures = {executor.submit(task, item): (index, item) for index, item in enumerate(items)}
+        for future in as_completed(futures):
+            index, item = futures[future]
+            try:
+                yield index, item, future.result(), None
+            except Exception as e:
+                yield index, item, None, e
+    finally:
+        # The client may have gone away - items that haven't started are not needed any more
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,519 @@
+import inspect
+import logging
+import os
+import queue
+import socket
+import sys
+import threading
+import time
+from multiprocessing.connection import Connection
+
+from playwright.sync_api import sync_playwright
+
+from metrics import process_rss
+from pipeline import ConversionCancelled, StandbyInterrupted, prepare_standby_page
+from sites import get_site
+from storage_state import storage_state
+
+# Recycle a browser whose processes have grown past this many resident bytes (0 disables)
+BROWSER_MAX_RSS_BYTES = int(os.environ.get('BROWSER_MAX_RSS_BYTES', 400 * 1024 * 1024))
+
+# Converter pages kept loaded and ready for input between jobs (0 disables). Chromium
+# runs with '--single-process', which is only safe for one tab, so keep this at 1 unless
+# the flags change.
+BROWSER_STANDBY_PAGES = int(os.environ.get('BROWSER_STANDBY_PAGES', 1))
+# Standby pages older than this are reloaded so a job never starts on a stale session
+BROWSER_STANDBY_MAX_AGE = float(os.environ.get('BROWSER_STANDBY_MAX_AGE', 120))
+# A standby page that isn't ready within this many seconds is given up on (jobs get 60s)
+BROWSER_STANDBY_LOAD_TIMEOUT = float(os.environ.get('BROWSER_STANDBY_LOAD_TIMEOUT', 20))
+# After a standby page fails to load, wait this long before trying again
+STANDBY_RETRY_DELAY = 15
+
+# Aggressive memory-saving flags (lowest possible footprint)
+CHROMIUM_ARGS = [
+    '--disable-dev-shm-usage',
+    '--no-sandbox',
+    '--disable-gpu',
+    '--disable-software-rasterizer',
+    '--no-zygote',  # Saves ~200MB when combined with single-process
+    '--single-process',  # Big memory saver (safe for one tab only)
+    '--disable-dev-tools',
+    '--disable-extensions',
+    '--disable-background-timer-throttling',
+    '--disable-backgrounding-occluded-windows',
+    '--disable-renderer-backgrounding',
+    '--memory-pressure-off',  # Prevent memory pressure checks
+    '--disable-background-networking',
+    '--disable-sync',
+    '--disable-translate',
+    '--metrics-recording-only',
+    '--no-first-run',
+    '--disable-setuid-sandbox'
+]
+
+# A shared batch browser keeps several contexts busy at once, which '--single-process'
+# cannot do safely
+SHARED_CHROMIUM_ARGS = [arg for arg in CHROMIUM_ARGS if arg != '--single-process']
+
+# Every job gets a fresh isolated context with these options (plus the saved storage
+# state when BROWSER_STORAGE_STATE is on)
+CONTEXT_OPTIONS = {
+    'viewport': {'width': 1280, 'height': 720},
+    'locale': 'en-US',
+    'timezone_id': 'America/New_York',
+    # Disable animations for faster rendering
+    'reduced_motion': 'reduce',
+}
+
+
+class StandbyPage:
+    # A converter page loaded in its own context ahead of time, waiting for a job
+
+    def __init__(self, context, page, site_name, interception):
+        self.context = context
+        self.page = page
+        self.site_name = site_name
+        self.interception = interception
+        self.ready_at = time.time()
+
+    def age(self):
+        return time.time() - self.ready_at
+
+
+class BrowserSession:
+    # One Playwright instance and one warm Chromium, owned by a browser worker process.
+    # Jobs get a fresh context each; the browser is relaunched after a crash, after
+    # max_jobs jobs or once it grows past BROWSER_MAX_RSS_BYTES. With an `endpoint` the
+    # session connects over CDP to a Chromium someone else launched instead (and leaves
+    # that browser's memory to its owner).
+
+    def __init__(self, name, max_jobs, endpoint=None):
+        self.name = name
+        self.endpoint = endpoint
+        self.max_jobs = max(1, max_jobs)
+        self.state = 'starting'
+        self.jobs_served = 0
+        self.total_jobs = 0
+        self.launches = 0
+        self.last_launch_seconds = None
+        self.last_error = None
+        self.connected = False
+        self.rss = None
+        self.standby = []
+        self.standby_hits = 0
+        # Converter the standby pages are for; follows the web process's primary site
+        self.standby_site = None
+        self._standby_retry_at = 0
+        self._playwright = None
+        self._browser = None
+
+    def start(self):
+        self._playwright = sync_playwright().start()
+        self._launch()
+
+    def stop(self):
+        self._close_browser()
+        if self._playwright is not None:
+            try:
+                self._playwright.stop()
+            except Exception as e:
+                logging.warning(f"[{self.name}] Error stopping Playwright: {e}")
+        self.state = 'stopped'
+
+    def _launch(self):
+        self.state = 'launching'
+        start_time = time.time()
+        try:
+            if self.endpoint:
+                self._browser = self._playwright.chromium.connect_over_cdp(self.endpoint)
+            else:
+                self._browser = self._playwright.chromium.launch(headless=True, args=CHROMIUM_ARGS)
+        except Exception as e:
+            logging.error(f"[{self.name}] Chromium launch failed: {e}", exc_info=True)
+            self._browser = None
+            self.state = 'error'
+            self.last_error = str(e)
+            return False
+
+        self._browser.on('disconnected', self._on_disconnected)
+        self.connected = True
+        self.jobs_served = 0
+        self.launches += 1
+        self.last_launch_seconds = time.time() - start_time
+        self.state = 'idle'
+        logging.info(f"🚀 [{self.name}] Chromium launched in {self.last_launch_seconds:.2f}s (launch #{self.launches})")
+        return True
+
+    def _on_disconnected(self, _browser):
+        logging.warning(f"⚠️ [{self.name}] Chromium disconnected")
+        self.connected = False
+
+    def _close_browser(self):
+        if self._browser is None:
+            return
+        try:
+            self._browser.close()
+            logging.info(f"[{self.name}] Browser closed, memory cleaned up")
+        except Exception as cleanup_error:
+            logging.warning(f"[{self.name}] Error closing browser: {cleanup_error}")
+        self._browser = None
+        self.connected = False
+        self.rss = None
+        # Standby contexts went away with the browser
+        self.standby = []
+
+    def recycle(self, reason):
+        logging.info(f"♻️ [{self.name}] Recycling browser ({reason})")
+        self._close_browser()
+        self._launch()
+
+    def check_health(self):
+        if self._browser is None:
+            # Launch failed earlier - try again
+            self._launch()
+        elif not (self.connected and self._browser.is_connected()):
+            self.recycle('health check failed')
+        elif self._over_memory_limit():
+            self.recycle(f'using {self.rss / (1024 * 1024):.0f}MB')
+
+    def _measure_rss(self):
+        # Chromium reports its own process ids over CDP; their RSS comes from /proc
+        session = self._browser.new_browser_cdp_session()
+        try:
+            processes = session.send('SystemInfo.getProcessInfo')['processInfo']
+        finally:
+            session.detach()
+        return sum(process_rss(process['id']) for process in processes)
+
+    def _over_memory_limit(self):
+        if self._browser is None or not BROWSER_MAX_RSS_BYTES or self.endpoint:
+            return False
+        try:
+            self.rss = self._measure_rss()
+        except Exception as e:
+            logging.debug(f"[{self.name}] Could not measure browser memory: {e}")
+            return False
+        return self.rss > BROWSER_MAX_RSS_BYTES
+
+    def _context_options(self):
+        saved = storage_state.current() if storage_state is not None else None
+        return dict(CONTEXT_OPTIONS, storage_state=saved) if saved else CONTEXT_OPTIONS
+
+    def _new_context(self):
+        if self._browser is None:
+            self.recycle('no browser')
+            if self._browser is None:
+                raise RuntimeError(f'Chromium is not available: {self.last_error}')
+        try:
+            return self._browser.new_context(**self._context_options())
+        except Exception as e:
+            # The browser most likely crashed since the last job - relaunch once and retry
+            logging.warning(f"[{self.name}] Could not create context ({e}), relaunching browser")
+            self.recycle('context creation failed')
+            if self._browser is None:
+                raise
+            return self._browser.new_context(**self._context_options())
+
+    def _discard_standby(self, standby):
+        try:
+            standby.context.close()
+        except Exception as e:
+            logging.warning(f"[{self.name}] Error closing standby context: {e}")
+
+    def maintain_standby(self, interrupted=None):
+        # Called while idle. Does at most one unit of work (drop a stale page or load a
+        # new one) so the worker goes back to its connection between steps. Loading stops
+        # early once `interrupted()` says a job is waiting.
+        if not BROWSER_STANDBY_PAGES or self._browser is None or not self.connected:
+            return
+        site = get_site(self.standby_site)
+        for standby in self.standby:
+            if standby.site_name != site.name:
+                logging.info(f"[{self.name}] Dropping standby page for {standby.site_name} (primary is now {site.name})")
+                self.standby.remove(standby)
+                self._discard_standby(standby)
+                return
+            if standby.age() > BROWSER_STANDBY_MAX_AGE or standby.page.is_closed():
+                logging.info(f"[{self.name}] Refreshing standby page (loaded {standby.age():.0f}s ago)")
+                self.standby.remove(standby)
+                self._discard_standby(standby)
+                return
+        if len(self.standby) >= BROWSER_STANDBY_PAGES or time.time() < self._standby_retry_at:
+            return
+
+        start_time = time.time()
+        context = None
+        try:
+            context = self._browser.new_context(**self._context_options())
+            page, interception = prepare_standby_page(context, site, timeout=BROWSER_STANDBY_LOAD_TIMEOUT,
+                                                      interrupted=interrupted)
+        except StandbyInterrupted:
+            logging.info(f"[{self.name}] Job arrived, dropping the half-loaded standby page")
+            try:
+                context.close()
+            except Exception:
+                pass
+            return
+        except Exception as e:
+            logging.warning(f"[{self.name}] Could not prepare a standby page: {e}")
+            self._standby_retry_at = time.time() + STANDBY_RETRY_DELAY
+            if context is not None:
+                try:
+                    context.close()
+                except Exception:
+                    pass
+            return
+        self.standby.append(StandbyPage(context, page, site.name, interception))
+        logging.info(f"♨️ [{self.name}] Standby page ready on {site.host} in {time.time() - start_time:.2f}s")
+
+    def _take_standby(self):
+        while self.standby:
+            standby = self.standby.pop(0)
+            if standby.age() <= BROWSER_STANDBY_MAX_AGE and not standby.page.is_closed():
+                return standby
+            self._discard_standby(standby)
+        return None
+
+    def run_task(self, func, args, progress=None, checkpoint=None):
+        # Calls func(context, *args) and returns its result. Tasks that take a `standby`
+        # argument get a pre-loaded converter page and its context when one is ready;
+        # everything else gets a fresh context. Tasks that take `progress` get the
+        # reporter that forwards their stage events to the web process, and tasks that
+        # take `checkpoint` a silent cancellation check for their long waits.
+        self.state = 'busy'
+        context = None
+        completed = False
+        parameters = inspect.signature(func).parameters
+        offered = {'progress': progress, 'checkpoint': checkpoint}
+        kwargs = {name: value for name, value in offered.items() if value is not None and name in parameters}
+        try:
+            standby = self._take_standby() if 'standby' in parameters else None
+            if standby is not None:
+                self.standby_hits += 1
+                context = standby.context
+                result = func(context, *args, standby=standby, **kwargs)
+            else:
+                context = self._new_context()
+                result = func(context, *args, **kwargs)
+            completed = True
+            return result
+        except ConversionCancelled:
+            raise
+        except Exception as e:
+            self.last_error = str(e)
+            raise
+        finally:
+            if completed and storage_state is not None:
+                # Cookies and localStorage from a clean run seed the next job's context
+                storage_state.save(context)
+            if context is not None:
+                try:
+                    context.close()
+                    logging.info(f"[{self.name}] Context closed")
+                except Exception as cleanup_error:
+                    logging.warning(f"[{self.name}] Error closing context: {cleanup_error}")
+
+            self.jobs_served += 1
+            self.total_jobs += 1
+            if self._browser is None or not (self.connected and self._browser.is_connected()):
+                self.recycle('browser crashed')
+            elif self.jobs_served >= self.max_jobs:
+                self.recycle(f'served {self.jobs_served} jobs')
+            elif self._over_memory_limit():
+                self.recycle(f'using {self.rss / (1024 * 1024):.0f}MB')
+            elif self.state == 'busy':
+                self.state = 'idle'
+
+    def health(self):
+        return {
+            'state': self.state,
+            'connected': self.connected,
+            'jobs_served': self.jobs_served,
+            'total_jobs': self.total_jobs,
+            'launches': self.launches,
+            'last_launch_seconds': self.last_launch_seconds,
+            'rss': self.rss,
+            'standby_pages': len(self.standby),
+            'standby_hits': self.standby_hits,
+            'storage_state': storage_state.stats() if storage_state is not None else None,
+            'last_error': self.last_error,
+        }
+
+
+def serve(conn, name, max_jobs):
+    # Request/reply loop over the IPC connection to the web process:
+    #   ('run', func, args) -> any number of ('progress', (stage, data), None), then
+    #                          ('result', value, health) or ('error', message, health)
+    #   ('cancel',)         -> sent while a task runs; its next progress report or checkpoint
+    #                          raises ConversionCancelled (ignored if the task already finished)
+    #   ('health',)         -> ('health', None, health)
+    #   ('standby', site)   -> keep standby pages for this converter site from now on
+    #   ('stop',)           -> exits
+    # The web process closing its end also ends the loop. Idle time is spent keeping
+    # standby pages loaded.
+    session = BrowserSession(name, max_jobs)
+    # Download segments report from their own threads
+    send_lock = threading.Lock()
+    cancelled = threading.Event()
+
+    def _check_cancelled():
+        # Caller holds send_lock. While a task runs the web process only ever sends 'cancel'.
+        if not cancelled.is_set() and conn.poll(0) and conn.recv()[0] == 'cancel':
+            cancelled.set()
+        if cancelled.is_set():
+            raise ConversionCancelled('Cancelled by the web process')
+
+    def checkpoint():
+        with send_lock:
+            _check_cancelled()
+
+    def report(stage, **data):
+        # Progress reports double as cancellation checkpoints
+        with send_lock:
+            _check_cancelled()
+            conn.send(('progress', (stage, data), None))
+
+    try:
+        session.start()
+        while True:
+            if not conn.poll(1 if BROWSER_STANDBY_PAGES else None):
+                session.maintain_standby(interrupted=lambda: conn.poll(0))
+                continue
+            try:
+                message = conn.recv()
+            except EOFError:
+                break
+            if message[0] == 'stop':
+                break
+            if message[0] == 'cancel':
+                # Arrived after its task had already finished
+                continue
+            if message[0] == 'standby':
+                session.standby_site = message[1]
+                continue
+            if message[0] == 'health':
+                session.check_health()
+                conn.send(('health', None, session.health()))
+                continue
+            _, func, args = message
+            cancelled.clear()
+            try:
+                result = session.run_task(func, args, progress=report, checkpoint=checkpoint)
+                reply = ('result', result, session.health())
+            except ConversionCancelled as e:
+                logging.info(f"[{name}] Task cancelled")
+                reply = ('error', str(e), session.health())
+            except Exception as e:
+                logging.error(f"[{name}] Task failed: {e}", exc_info=True)
+                reply = ('error', str(e) or e.__class__.__name__, session.health())
+            conn.send(reply)
+    finally:
+        session.stop()
+        conn.close()
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def serve_shared(conn, name, max_jobs, slots):
+    # Like serve(), but for one multi-process Chromium running up to `slots` tasks at
+    # once, each on its own thread and context. Messages carry a task id:
+    #   ('run', task_id, func, args) -> any number of ('progress', task_id, (stage, data)),
+    #                                   then ('result', task_id, value) or ('error', task_id, message)
+    #   ('cancel', task_id)          -> that task's next progress report or checkpoint raises
+    #   ('stop',)                    -> finishes the running tasks and exits
+    send_lock = threading.Lock()
+    tasks = queue.Queue()
+    cancelled = {}
+
+    def send(message):
+        with send_lock:
+            conn.send(message)
+
+    def run_slot(session):
+        # Every slot thread has its own Playwright connection - sync Playwright objects
+        # must stay on the thread that created them
+        session.start()
+        try:
+            while True:
+                item = tasks.get()
+                if item is None:
+                    break
+                task_id, func, args = item
+                flag = cancelled[task_id]
+
+                def checkpoint():
+                    if flag.is_set():
+                        raise ConversionCancelled('Cancelled by the web process')
+
+                def report(stage, **data):
+                    checkpoint()
+                    send(('progress', task_id, (stage, data)))
+
+                try:
+                    reply = ('result', task_id, session.run_task(func, args, progress=report, checkpoint=checkpoint))
+                except ConversionCancelled as e:
+                    logging.info(f"[{session.name}] Task cancelled")
+                    reply = ('error', task_id, str(e))
+                except Exception as e:
+                    logging.error(f"[{session.name}] Task failed: {e}", exc_info=True)
+                    reply = ('error', task_id, str(e) or e.__class__.__name__)
+                cancelled.pop(task_id, None)
+                send(reply)
+        finally:
+            session.stop()
+
+    playwright = sync_playwright().start()
+    browser = None
+    threads = []
+    try:
+        port = _free_port()
+        endpoint = f'http://127.0.0.1:{port}'
+        browser = playwright.chromium.launch(headless=True, args=SHARED_CHROMIUM_ARGS + [f'--remote-debugging-port={port}'])
+        logging.info(f"🚀 [{name}] Shared Chromium listening on {endpoint} for {slots} parallel tasks")
+        for index in range(slots):
+            session = BrowserSession(f'{name}-{index}', max_jobs, endpoint=endpoint)
+            thread = threading.Thread(target=run_slot, args=(session,), name=session.name, daemon=True)
+            thread.start()
+            threads.append(thread)
+
+        while True:
+            try:
+                message = conn.recv()
+            except EOFError:
+                break
+            if message[0] == 'stop':
+                break
+            if message[0] == 'cancel':
+                if message[1] in cancelled:
+                    cancelled[message[1]].set()
+                continue
+            _, task_id, func, args = message
+            cancelled[task_id] = threading.Event()
+            tasks.put((task_id, func, args))
+    finally:
+        for _ in threads:
+            tasks.put(None)
+        for thread in threads:
+            thread.join(timeout=30)
+        if browser is not None:
+            try:
+                browser.close()
+            except Exception as e:
+                logging.warning(f"[{name}] Error closing shared Chromium: {e}")
+        playwright.stop()
+        conn.close()
+
+
+if __name__ == '__main__':
+    # Started by browser_pool: python -m browser_worker <fd> <name> <max_jobs> [<slots>]
+    # (with <slots>, a shared multi-context browser for batches - see serve_shared)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    fd, worker_name, worker_max_jobs = int(sys.argv[1]), sys.argv[2], int(sys.argv[3])
+    if len(sys.argv) > 4:
+        serve_shared(Connection(fd), worker_name, worker_max_jobs, int(sys.argv[4]))
+    else:
+        serve(Connection(fd), worker_name, worker_max_jobs)
@@ -0,0 +1,210 @@
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+# Tail-sampled diagnostics: every browser run records a Playwright trace and its recent
+# network requests, but they are only written to disk for runs that fail or are slow
+DIAGNOSTICS_ENABLED = os.environ.get('DIAGNOSTICS_ENABLED', '0') == '1'
+# Shared by the browser workers (which write artifacts) and the web process (which lists them)
+DIAGNOSTICS_DIR = os.environ.get('DIAGNOSTICS_DIR', os.path.expanduser('~/.cache/chromium-launcher/diagnostics'))
+# Runs that take longer than this keep their artifacts even when they succeed
+DIAGNOSTICS_SLOW_SECONDS = float(os.environ.get('DIAGNOSTICS_SLOW_SECONDS', 30))
+# DOM snapshots make traces replayable in the trace viewer but cost noticeably more
+DIAGNOSTICS_SNAPSHOTS = os.environ.get('DIAGNOSTICS_SNAPSHOTS', '0') == '1'
+# Only the last this-many requests of a run end up in its HAR
+DIAGNOSTICS_HAR_ENTRIES = int(os.environ.get('DIAGNOSTICS_HAR_ENTRIES', 300))
+# Oldest artifacts are deleted once the directory grows past this size or they pass this age
+DIAGNOSTICS_MAX_BYTES = int(os.environ.get('DIAGNOSTICS_MAX_BYTES', 200 * 1024 * 1024))
+DIAGNOSTICS_MAX_AGE = float(os.environ.get('DIAGNOSTICS_MAX_AGE', 24 * 3600))
+
+# Artifact ids are job ids, optionally with a hedging attempt number
+ARTIFACT_ID_RE = re.compile(r'^[0-9a-f]{32}(-\d+)?$')
+ARTIFACT_FILES = ('meta.json', 'trace.zip', 'har.json')
+
+
+def _har_timings(timing):
+    # Playwright reports milliseconds since startTime, -1 where a phase didn't happen
+    def span(start, end):
+        return round(timing[end] - timing[start], 3) if timing[start] >= 0 and timing[end] >= 0 else -1
+    return {
+        'blocked': -1,
+        'dns': span('domainLookupStart', 'domainLookupEnd'),
+        'connect': span('connectStart', 'connectEnd'),
+        'ssl': span('secureConnectionStart', 'connectEnd'),
+        'send': 0,
+        'wait': span('requestStart', 'responseStart'),
+        'receive': span('responseStart', 'responseEnd'),
+    }
+
+
+class RunRecorder:
+    # Cheap while a run is in flight: tracing stays in the driver's memory and requests
+    # are only kept as references in a bounded deque. Everything is materialised in
+    # finish() if the run turns out to be worth keeping.
+
+    def __init__(self, context, page, store):
+        self.context = context
+        self.store = store
+        self.started_at = time.time()
+        self.requests = deque(maxlen=DIAGNOSTICS_HAR_ENTRIES)
+        self.tracing = False
+        try:
+            context.tracing.start(screenshots=False, snapshots=DIAGNOSTICS_SNAPSHOTS, sources=False)
+            self.tracing = True
+        except Exception as e:
+            logging.warning(f"Could not start tracing: {e}")
+        page.on('requestfinished', self.requests.append)
+        page.on('requestfailed', self.requests.append)
+
+    def sample_reason(self, failure):
+        if failure:
+            return failure
+        elapsed = time.time() - self.started_at
+        if elapsed > DIAGNOSTICS_SLOW_SECONDS:
+            return f'slow ({elapsed:.1f}s)'
+        return None
+
+    def _har(self):
+        entries = []
+        for request in self.requests:
+            try:
+                response = request.response()
+                timing = request.timing
+                timings = _har_timings(timing)
+                started = datetime.fromtimestamp(timing['startTime'] / 1000, timezone.utc)
+                size = int((response.headers.get('content-length') if response else None) or -1)
+                entries.append({
+                    'startedDateTime': started.isoformat(),
+                    'time': round(max(timing['responseEnd'], 0), 3),
+                    'request': {
+                        'method': request.method, 'url': request.url, 'httpVersion': '', 'cookies': [],
+                        'headers': [], 'queryString': [], 'headersSize': -1, 'bodySize': -1,
+                    },
+                    'response': {
+                        'status': response.status if response else 0,
+                        'statusText': response.status_text if response else (request.failure or ''),
+                        'httpVersion': '', 'cookies': [], 'headers': [], 'redirectURL': '',
+                        'headersSize': -1, 'bodySize': size,
+                        'content': {'size': size, 'mimeType': response.headers.get('content-type', '') if response else ''},
+                    },
+                    'cache': {},
+                    'timings': timings,
+                    '_resourceType': request.resource_type,
+                })
+            except Exception as e:
+                logging.debug(f"Skipping request in HAR: {e}")
+        return {'log': {'version': '1.2', 'creator': {'name': 'chromium-launcher', 'version': '1'},
+                        'pages': [], 'entries': entries}}
+
+    def finish(self, artifact_id, failure=None, details=None):
+        # Keeps the artifacts when the run failed or was slow, otherwise throws them away
+        reason = self.sample_reason(failure)
+        if reason is None:
+            self._stop_tracing(None)
+            return None
+        # Diagnostics must never turn into the reason a job fails
+        try:
+            directory = self.store.directory_for(artifact_id)
+            os.makedirs(directory, exist_ok=True)
+            self._stop_tracing(os.path.join(directory, 'trace.zip'))
+            with open(os.path.join(directory, 'har.json'), 'w') as f:
+                json.dump(self._har(), f)
+            meta = dict(details or {}, reason=reason, seconds=round(time.time() - self.started_at, 2),
+                        recorded_at=time.time())
+            with open(os.path.join(directory, 'meta.json'), 'w') as f:
+                json.dump(meta, f, indent=2)
+            self.store.enforce_retention()
+        except Exception as e:
+            logging.warning(f"Could not save diagnostics for {artifact_id}: {e}")
+            self._stop_tracing(None)
+            return None
+        logging.info(f"🔬 Kept diagnostics for {artifact_id}: {reason}")
+        return reason
+
+    def _stop_tracing(self, path):
+        if not self.tracing:
+            return
+        self.tracing = False
+        try:
+            if path:
+                self.context.tracing.stop(path=path)
+            else:
+                self.context.tracing.stop()
+        except Exception as e:
+            logging.warning(f"Could not stop tracing: {e}")
+
+
+class DiagnosticsStore:
+    # One directory per kept run: <DIAGNOSTICS_DIR>/<artifact id>/{meta.json,trace.zip,har.json}
+
+    def __init__(self, directory=DIAGNOSTICS_DIR, max_bytes=DIAGNOSTICS_MAX_BYTES, max_age=DIAGNOSTICS_MAX_AGE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def directory_for(self, artifact_id):
+        if not ARTIFACT_ID_RE.match(artifact_id):
+            raise ValueError(f'Invalid artifact id: {artifact_id}')
+        return os.path.join(self.directory, artifact_id)
+
+    def recorder(self, context, page):
+        return RunRecorder(context, page, self)
+
+    def _entries(self):
+        # (mtime, size, artifact id) of every kept run
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not ARTIFACT_ID_RE.match(name) or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+                entries.append((os.path.getmtime(path), size, name))
+            except OSError:
+                continue
+        return entries
+
+    def enforce_retention(self):
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            cutoff = time.time() - self.max_age
+            for mtime, size, name in entries:
+                if total <= self.max_bytes and mtime >= cutoff:
+                    break
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+                total -= size
+
+    def list(self, job_id):
+        # Kept runs for a job - hedged jobs can have one per attempt
+        runs = []
+        for _, _, name in sorted(self._entries()):
+            if name != job_id and not name.startswith(job_id + '-'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                with open(os.path.join(path, 'meta.json')) as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                meta = {}
+            files = {f: os.path.getsize(os.path.join(path, f)) for f in ARTIFACT_FILES
+                     if os.path.exists(os.path.join(path, f))}
+            runs.append({'artifact_id': name, 'meta': meta, 'files': files})
+        return runs
+
+    def file_path(self, artifact_id, filename):
+        if filename not in ARTIFACT_FILES:
+            return None
+        path = os.path.join(self.directory_for(artifact_id), filename)
+        return path if os.path.exists(path) else None
+
+
+diagnostics = DiagnosticsStore() if DIAGNOSTICS_ENABLED else None
@@ -0,0 +1,251 @@
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Bytes read from the network per write - keeps memory flat regardless of track length
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get('DOWNLOAD_CHUNK_SIZE', 64 * 1024))
+# Parallel byte-range segments per file when the server supports Range
+DOWNLOAD_SEGMENTS = int(os.environ.get('DOWNLOAD_SEGMENTS', 4))
+# Files smaller than twice this are fetched in one piece; also the size of the first probe request
+DOWNLOAD_MIN_SEGMENT_BYTES = int(os.environ.get('DOWNLOAD_MIN_SEGMENT_BYTES', 1024 * 1024))
+# Attempts per segment (or per file without Range support) before giving up
+DOWNLOAD_RETRIES = int(os.environ.get('DOWNLOAD_RETRIES', 3))
+# First retry waits this long, doubling on each further attempt
+DOWNLOAD_BACKOFF = float(os.environ.get('DOWNLOAD_BACKOFF', 0.5))
+DOWNLOAD_TIMEOUT = float(os.environ.get('DOWNLOAD_TIMEOUT', 60))
+# Keep-alive connections shared by every download in this process
+DOWNLOAD_POOL_SIZE = int(os.environ.get('DOWNLOAD_POOL_SIZE', 16))
+# Minimum time between two progress reports for the same download
+DOWNLOAD_PROGRESS_INTERVAL = float(os.environ.get('DOWNLOAD_PROGRESS_INTERVAL', 0.25))
+
+CONTENT_RANGE_RE = re.compile(r'bytes (\d+)-(\d+)/(\d+)')
+
+
+class DownloadError(IOError):
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+def _status_error(response, message):
+    # Client errors won't change on a retry; timeouts, throttling and 5xx might
+    retryable = response.status_code >= 500 or response.status_code in (408, 429)
+    return DownloadError(f'{message}: {response.status_code}', retryable=retryable)
+
+
+_session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=DOWNLOAD_POOL_SIZE, pool_maxsize=DOWNLOAD_POOL_SIZE)
+_session.mount('http://', _adapter)
+_session.mount('https://', _adapter)
+
+
+class DownloadStats:
+    def __init__(self):
+        self.size = 0
+        self.received = 0
+        self.segments = 1
+        self.retries = 0
+        self.resumes = 0
+        self.ranged = False
+        self.seconds = 0
+        self._lock = threading.Lock()
+
+    def add(self, count):
+        with self._lock:
+            self.received += count
+            return self.received
+
+    def count_retry(self, resumed):
+        with self._lock:
+            self.retries += 1
+            if resumed:
+                self.resumes += 1
+
+    def to_dict(self):
+        return {
+            'size': self.size,
+            'segments': self.segments,
+            'ranged': self.ranged,
+            'retries': self.retries,
+            'resumes': self.resumes,
+            'seconds': round(self.seconds, 3),
+            'throughput': round(self.size / self.seconds) if self.seconds else None,
+        }
+
+
+class SegmentedDownload:
+    # One file fetched over the shared connection pool. The first request asks for the
+    # first DOWNLOAD_MIN_SEGMENT_BYTES; a 206 tells us the total size and that Range works,
+    # so the rest is split into segments fetched in parallel and written in place. Every
+    # segment resumes from its last written byte when a read fails.
+
+    def __init__(self, url, path, progress=None, segments=DOWNLOAD_SEGMENTS, retries=DOWNLOAD_RETRIES):
+        self.url = url
+        self.path = path
+        self.partial_path = path + '.part'
+        self.progress = progress
+        self.max_segments = max(1, segments)
+        self.retries = max(1, retries)
+        self.stats = DownloadStats()
+        self.total = None
+
+    def _report(self, count):
+        received = self.stats.add(count)
+        if self.progress is not None:
+            self.progress(received, self.total)
+
+    def _backoff(self, attempt, error, resumed=False):
+        delay = DOWNLOAD_BACKOFF * (2 ** attempt)
+        logging.warning(f"Download attempt {attempt + 1} failed ({error}), retrying in {delay:.1f}s")
+        self.stats.count_retry(resumed)
+        time.sleep(delay)
+
+    def _fetch_range(self, start, end):
+        # Writes bytes start..end (inclusive) at their offset, resuming after failures
+        offset = start
+        for attempt in range(self.retries):
+            try:
+                with _session.get(self.url, headers={'Range': f'bytes={offset}-{end}'}, stream=True,
+                                  timeout=DOWNLOAD_TIMEOUT) as response:
+                    if response.status_code != 206:
+                        raise _status_error(response, 'Range request returned status code')
+                    fd = os.open(self.partial_path, os.O_WRONLY)
+                    try:
+                        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                            if not chunk:
+                                continue
+                            chunk = chunk[:end + 1 - offset]
+                            os.pwrite(fd, chunk, offset)
+                            offset += len(chunk)
+                            self._report(len(chunk))
+                            if offset > end:
+                                break
+                    finally:
+                        os.close(fd)
+                if offset > end:
+                    return
+                raise DownloadError(f'Segment ended early at byte {offset} of {start}-{end}')
+            except (requests.RequestException, DownloadError) as e:
+                if attempt == self.retries - 1 or not getattr(e, 'retryable', True):
+                    raise DownloadError(f'Segment {start}-{end} failed after {self.retries} attempts: {e}')
+                # The next attempt picks up from the last byte written
+                self._backoff(attempt, e, resumed=offset > start)
+
+    def _stream_whole(self, response):
+        # No Range support - plain sequential download; a retry starts over
+        expected = response.headers.get('Content-Length')
+        self.total = int(expected) if expected and expected.isdigit() else None
+        size = 0
+        with open(self.partial_path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                if chunk:
+                    f.write(chunk)
+                    size += len(chunk)
+                    self._report(len(chunk))
+        if self.total is not None and size != self.total:
+            raise DownloadError(f'Received {size} bytes but Content-Length was {self.total}')
+        return size
+
+    def _probe(self):
+        # The first segment doubles as the Range capability check
+        first_end = DOWNLOAD_MIN_SEGMENT_BYTES - 1
+        for attempt in range(self.retries):
+            self.stats.received = 0
+            try:
+                with _session.get(self.url, headers={'Range': f'bytes=0-{first_end}'}, stream=True,
+                                  timeout=DOWNLOAD_TIMEOUT) as response:
+                    if response.status_code == 200:
+                        return self._stream_whole(response)
+                    if response.status_code != 206:
+                        raise _status_error(response, 'Download failed with status code')
+                    match = CONTENT_RANGE_RE.match(response.headers.get('Content-Range', ''))
+                    if not match or int(match.group(1)) != 0:
+                        raise DownloadError('Server sent an unusable Content-Range')
+                    self.total = int(match.group(3))
+                    self.stats.ranged = True
+                    with open(self.partial_path, 'wb') as f:
+                        f.truncate(self.total)
+                        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                            if chunk:
+                                f.write(chunk)
+                                self._report(len(chunk))
+                    first_received = self.stats.received
+                break
+            except (requests.RequestException, DownloadError) as e:
+                if attempt == self.retries - 1 or not getattr(e, 'retryable', True):
+                    raise
+                self._backoff(attempt, e)
+
+        if first_received < min(DOWNLOAD_MIN_SEGMENT_BYTES, self.total):
+            # The probe was cut short - fetch the missing part of the first segment too
+            self._fetch_range(first_received, min(first_end, self.total - 1))
+        return None
+
+    def run(self):
+        start_time = time.time()
+        try:
+            size = self._probe()
+            if size is None:
+                size = self._fetch_remaining()
+            os.replace(self.partial_path, self.path)
+        except Exception:
+            if os.path.exists(self.partial_path):
+                os.remove(self.partial_path)
+            raise
+        self.stats.size = size
+        self.stats.seconds = time.time() - start_time
+        return self.stats
+
+    def _fetch_remaining(self):
+        start = DOWNLOAD_MIN_SEGMENT_BYTES
+        remaining = self.total - start
+        if remaining > 0:
+            # Segments are at least DOWNLOAD_MIN_SEGMENT_BYTES so small files don't fan out
+            count = max(1, min(self.max_segments, remaining // DOWNLOAD_MIN_SEGMENT_BYTES))
+            step = -(-remaining // count)
+            ranges = [(offset, min(offset + step, self.total) - 1) for offset in range(start, self.total, step)]
+            self.stats.segments = len(ranges) + 1
+            if len(ranges) == 1:
+                self._fetch_range(*ranges[0])
+            else:
+                with ThreadPoolExecutor(max_workers=len(ranges), thread_name_prefix='download') as executor:
+                    for future in [executor.submit(self._fetch_range, *r) for r in ranges]:
+                        future.result()
+
+        size = os.path.getsize(self.partial_path)
+        if self.stats.received != self.total or size != self.total:
+            raise DownloadError(f'Received {self.stats.received} bytes but the file is {self.total} bytes')
+        return size
+
+
+def download_progress(report, interval=DOWNLOAD_PROGRESS_INTERVAL):
+    # Turns a job progress reporter - report(stage, **data) - into a download_file
+    # callback, rate-limited because every segment thread reports each chunk
+    if report is None:
+        return None
+    lock = threading.Lock()
+    last = {'time': 0, 'received': -1}
+
+    def progress(received, total):
+        now = time.time()
+        with lock:
+            if received <= last['received'] or (received != total and now - last['time'] < interval):
+                return
+            last.update(time=now, received=received)
+            report('download', received=received, total=total)
+    return progress
+
+
+def download_file(url, path, progress=None):
+    # Downloads url to path (which only appears once complete) and returns DownloadStats.
+    # `progress(received, total)` is called as bytes arrive; total is None if unknown.
+    stats = SegmentedDownload(url, path, progress).run()
+    logging.info(f"📥 Downloaded {stats.size} bytes in {stats.seconds:.2f}s over {stats.segments} segment(s)"
+                 f" ({stats.retries} retries)")
+    return stats
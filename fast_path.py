@@ -0,0 +1,386 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from urllib.parse import quote, quote_plus, urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from audio_store import audio_path
+from downloader import download_file, download_progress
+from metrics import StageTimer
+from sites import get_site
+
+# Browser-less mode: the converter's own XHR/fetch calls are recorded during a browser
+# run and replayed with plain HTTP. Jobs fall back to the browser whenever replay fails.
+FAST_PATH_ENABLED = os.environ.get('FAST_PATH_ENABLED', '0') == '1'
+# Learned API recipes, one JSON file per converter site
+FAST_PATH_DIR = os.environ.get('FAST_PATH_DIR', os.path.expanduser('~/.cache/chromium-launcher/recipes'))
+FAST_PATH_MAX_WAIT = float(os.environ.get('FAST_PATH_MAX_WAIT', 60))
+FAST_PATH_POLL_INTERVAL = float(os.environ.get('FAST_PATH_POLL_INTERVAL', 0.5))
+# Consecutive replay failures before a recipe is dropped and learned again by the next browser run
+FAST_PATH_MAX_FAILURES = int(os.environ.get('FAST_PATH_MAX_FAILURES', 3))
+# Keep-alive connections shared by all replays
+FAST_PATH_POOL_SIZE = int(os.environ.get('FAST_PATH_POOL_SIZE', 10))
+
+# Request headers worth replaying; cookies and browser-managed headers are left out
+REPLAY_HEADERS = ('accept', 'content-type', 'origin', 'referer', 'user-agent', 'x-requested-with')
+# Response values shorter than this are too generic to be treated as ids/tokens
+MIN_TOKEN_LENGTH = 6
+PLACEHOLDER_RE = re.compile(r'\{\{(\w+)(?:\|(\w+))?\}\}')
+ENCODINGS = {
+    'raw': lambda value: value,
+    'quote': lambda value: quote(value, safe=''),
+    'quote_plus': quote_plus,
+    'json': lambda value: json.dumps(value)[1:-1],
+}
+
+
+class FastPathError(Exception):
+    pass
+
+
+def _scalars(value, path=()):
+    # (path, value) for every string/number leaf of a JSON document
+    if isinstance(value, dict):
+        for key, child in value.items():
+            yield from _scalars(child, path + (key,))
+    elif isinstance(value, list):
+        for index, child in enumerate(value):
+            yield from _scalars(child, path + (index,))
+    elif isinstance(value, (str, int, float)) and not isinstance(value, bool):
+        yield path, value
+
+
+def _lookup(value, path):
+    for key in path:
+        try:
+            value = value[key]
+        except (KeyError, IndexError, TypeError):
+            return None
+    return value
+
+
+def _templatize(text, replacements):
+    # Replaces every known value (longest first, in any of its encodings) with a placeholder
+    if not text:
+        return text
+    for value, name in sorted(replacements.items(), key=lambda item: -len(item[0])):
+        for encoding, encode in ENCODINGS.items():
+            encoded = encode(value)
+            if encoded in text:
+                placeholder = '{{' + name + ('' if encoding == 'raw' else '|' + encoding) + '}}'
+                text = text.replace(encoded, placeholder)
+                break
+    return text
+
+
+def _mentions(text, value):
+    return bool(text) and any(encode(value) in text for encode in ENCODINGS.values())
+
+
+def _render(template, values):
+    if not template:
+        return template
+
+    def substitute(match):
+        if match.group(1) not in values:
+            raise FastPathError(f'Recipe refers to unknown value {match.group(1)}')
+        return ENCODINGS[match.group(2) or 'raw'](str(values[match.group(1)]))
+    return PLACEHOLDER_RE.sub(substitute, template)
+
+
+def learn_recipe(calls, video_url, download_url):
+    # Turns the recorded API calls of one successful run into a replayable recipe:
+    # the call that submitted the video, every call after it up to the one whose JSON
+    # response carried the download link, with ids from earlier responses templated.
+    final = None
+    for index, call in enumerate(calls):
+        for path, value in _scalars(call['json']):
+            if isinstance(value, str) and urljoin(call['url'], value) == download_url:
+                final, download_path = index, list(path)
+                break
+        if final is not None:
+            break
+    if final is None:
+        return None
+
+    submit = next((index for index, call in enumerate(calls[:final + 1])
+                   if _mentions(call['url'] + (call['body'] or ''), video_url)), None)
+    if submit is None:
+        return None
+
+    replacements = {video_url: 'video_url'}
+    variables = {}
+    steps = []
+    for call in calls[submit:final + 1]:
+        template = {
+            'method': call['method'],
+            'url': _templatize(call['url'], replacements),
+            'body': _templatize(call['body'], replacements),
+            'headers': call['headers'],
+        }
+        if steps and all(steps[-1][key] == value for key, value in template.items()):
+            # The same request again - the page was polling it
+            steps[-1]['responses'].append(call['json'])
+            continue
+        steps.append(dict(template, responses=[call['json']]))
+        for path, value in _scalars(call['json']):
+            token = str(value)
+            if len(token) >= MIN_TOKEN_LENGTH and ' ' not in token and token not in replacements:
+                name = f'v{len(variables)}'
+                variables[name] = {'step': len(steps) - 1, 'path': list(path)}
+                replacements[token] = name
+
+    # Only keep variables a later request actually uses
+    used = set()
+    for step in steps:
+        used.update(match.group(1) for match in PLACEHOLDER_RE.finditer(step['url'] + (step['body'] or '')))
+
+    for step in steps:
+        responses = step.pop('responses')
+        # A polled step is done once the status-like fields that changed while polling
+        # (present from the first response on, e.g. state or progress) reach their final values
+        first = dict(_scalars(responses[0]))
+        step['until'] = [[list(path), value] for path, value in _scalars(responses[-1])
+                         if len(responses) > 1 and path in first and first[path] != value
+                         and list(path) != download_path]
+    return {
+        'steps': steps,
+        'variables': {name: spec for name, spec in variables.items() if name in used},
+        'download_path': download_path,
+        'learned_at': time.time(),
+    }
+
+
+class ApiRecorder:
+    # Collects the XHR/fetch traffic of one browser run. Bodies are read only when a
+    # recipe is learned, so recording costs nothing on runs that don't need it.
+
+    def __init__(self, page):
+        self.page = page
+        self.responses = []
+        page.on('response', self._on_response)
+
+    def _on_response(self, response):
+        if response.request.resource_type in ('xhr', 'fetch'):
+            self.responses.append(response)
+
+    def calls(self):
+        calls = []
+        for response in self.responses:
+            request = response.request
+            try:
+                payload = response.json()
+            except Exception:
+                payload = None
+            headers = {name: value for name, value in request.headers.items() if name.lower() in REPLAY_HEADERS}
+            calls.append({
+                'method': request.method,
+                'url': request.url,
+                'body': request.post_data,
+                'headers': headers,
+                'status': response.status,
+                'json': payload,
+            })
+        return calls
+
+    def learn(self, site, video_url, download_url):
+        try:
+            recipe = learn_recipe(self.calls(), video_url, download_url)
+        except Exception as e:
+            logging.warning(f"Could not learn an API recipe for {site.name}: {e}")
+            return None
+        if recipe is None:
+            logging.info(f"No replayable API calls found for {site.name}, fast path stays unavailable")
+            return None
+        recipes.save(site.name, recipe)
+        logging.info(f"⚡ Learned a {len(recipe['steps'])}-step API recipe for {site.name}")
+        return recipe
+
+
+def _valid_path(path):
+    return isinstance(path, list) and all(isinstance(key, (str, int)) for key in path)
+
+
+def valid_recipe(recipe):
+    # Shape check for a recipe read from disk - a hand-edited or half-written file must
+    # not get as far as replay()
+    if not isinstance(recipe, dict) or not _valid_path(recipe.get('download_path')):
+        return False
+    steps, variables = recipe.get('steps'), recipe.get('variables')
+    if not isinstance(steps, list) or not steps or not isinstance(variables, dict):
+        return False
+    for step in steps:
+        if not (isinstance(step, dict) and isinstance(step.get('method'), str) and isinstance(step.get('url'), str)
+                and isinstance(step.get('body'), (str, type(None))) and isinstance(step.get('headers'), dict)
+                and isinstance(step.get('until'), list)):
+            return False
+        if not all(isinstance(pair, list) and len(pair) == 2 and _valid_path(pair[0]) for pair in step['until']):
+            return False
+    return all(isinstance(spec, dict) and isinstance(spec.get('step'), int) and 0 <= spec['step'] < len(steps)
+               and _valid_path(spec.get('path')) for spec in variables.values())
+
+
+class RecipeStore:
+    # Recipes are written by browser workers and read by the web process, so they live on disk
+
+    def __init__(self, directory=FAST_PATH_DIR, max_failures=FAST_PATH_MAX_FAILURES):
+        self.directory = directory
+        self.max_failures = max_failures
+        self.failures = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, site_name):
+        return os.path.join(self.directory, f'{site_name}.json')
+
+    def has(self, site_name):
+        return os.path.exists(self._path(site_name))
+
+    def load(self, site_name):
+        # None when there is no recipe; an unreadable or malformed one is dropped so the
+        # next browser run learns it again
+        try:
+            with open(self._path(site_name)) as f:
+                recipe = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            recipe, reason = None, e
+        else:
+            reason = 'unexpected format'
+        if valid_recipe(recipe):
+            return recipe
+        logging.warning(f"Dropping the API recipe for {site_name}: {reason}")
+        self.drop(site_name)
+        return None
+
+    def drop(self, site_name):
+        try:
+            os.remove(self._path(site_name))
+        except FileNotFoundError:
+            pass
+
+    def save(self, site_name, recipe):
+        path = self._path(site_name)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(recipe, f, indent=2)
+        os.replace(path + '.tmp', path)
+        with self._lock:
+            self.failures[site_name] = 0
+
+    def record(self, site_name, ok):
+        with self._lock:
+            self.failures[site_name] = 0 if ok else self.failures.get(site_name, 0) + 1
+            if self.failures[site_name] < self.max_failures:
+                return
+            self.failures[site_name] = 0
+        logging.warning(f"Dropping the API recipe for {site_name} after {self.max_failures} failed replays")
+        self.drop(site_name)
+
+
+recipes = RecipeStore()
+
+# One keep-alive connection pool for every replay; each job still gets its own cookie jar
+_adapter = HTTPAdapter(pool_connections=FAST_PATH_POOL_SIZE, pool_maxsize=FAST_PATH_POOL_SIZE)
+
+
+def _new_session():
+    session = requests.Session()
+    session.mount('http://', _adapter)
+    session.mount('https://', _adapter)
+    return session
+
+
+def _step_done(step, payload, final, download_path):
+    if any(_lookup(payload, path) != value for path, value in step['until']):
+        return False
+    return not final or bool(_lookup(payload, download_path))
+
+
+def replay(recipe, video_url, session, max_wait=FAST_PATH_MAX_WAIT):
+    # Runs the recipe for a new video and returns the download URL
+    deadline = time.time() + max_wait
+    responses = []
+    values = {'video_url': video_url}
+    for index, step in enumerate(recipe['steps']):
+        final = index == len(recipe['steps']) - 1
+        url = _render(step['url'], values)
+        body = _render(step['body'], values)
+        while True:
+            response = session.request(step['method'], url, data=body.encode('utf-8') if body else None,
+                                       headers=step['headers'], timeout=30)
+            if response.status_code >= 400:
+                raise FastPathError(f'{step["method"]} {url[:100]} returned HTTP {response.status_code}')
+            try:
+                payload = response.json()
+            except ValueError:
+                raise FastPathError(f'{step["method"]} {url[:100]} did not return JSON')
+            if isinstance(payload, dict) and payload.get('error'):
+                raise FastPathError(f'Converter reported an error: {str(payload["error"])[:200]}')
+            if _step_done(step, payload, final, recipe['download_path']):
+                break
+            if time.time() >= deadline:
+                raise FastPathError(f'Conversion not finished after {max_wait:.0f}s')
+            time.sleep(FAST_PATH_POLL_INTERVAL)
+        responses.append(payload)
+        for name, spec in recipe['variables'].items():
+            if spec['step'] == index:
+                values[name] = _lookup(payload, spec['path'])
+    return urljoin(url, _lookup(responses[-1], recipe['download_path']))
+
+
+def convert(url, output_id, site=None, progress=None):
+    # Browser-less conversion. Returns a result shaped like pipeline.run_conversion's,
+    # None when no recipe has been learned yet, and raises FastPathError if replay fails.
+    # `progress(stage, **data)` hears about the same stages as the browser pipeline.
+    site = site or get_site()
+    recipe = recipes.load(site.name)
+    if recipe is None:
+        return None
+
+    timer = StageTimer()
+    start_time = time.time()
+    # Not closed afterwards - closing a session would also close the shared adapter
+    session = _new_session()
+    if progress is not None:
+        progress('converting', site=site.host, path='http')
+    try:
+        with timer.stage('api_conversion'):
+            download_url = replay(recipe, url, session)
+        conversion_waited = round(time.time() - start_time, 2)
+        logging.info(f"⚡ Fast path produced a download link after {conversion_waited:.2f}s")
+        with timer.stage('download'):
+            download_stats = download_file(download_url, audio_path(output_id), progress=download_progress(progress))
+    except (FastPathError, requests.RequestException, OSError) as e:
+        recipes.record(site.name, ok=False)
+        raise FastPathError(str(e) or e.__class__.__name__)
+    except Exception as e:
+        # A recipe that doesn't fit this video's responses - still just a reason to use the browser
+        logging.warning(f"Unexpected error replaying the API recipe for {site.name}: {e!r}")
+        recipes.record(site.name, ok=False)
+        raise FastPathError(f'Recipe replay failed: {e!r}')
+    recipes.record(site.name, ok=True)
+
+    logging.info(f"✅ Audio file downloaded via fast path! Size: {download_stats.size} bytes")
+    return {
+        'status': 'success',
+        'message': '✅ SUCCESS! Converted without a browser',
+        'site': site.name,
+        'screenshot_format': None,
+        'screenshot_url': None,
+        'download_button_found': True,
+        'download_button_clickable': True,
+        'audio_downloaded': True,
+        'audio_size': download_stats.size,
+        'conversion_state': 'ready',
+        'conversion_signal': 'api',
+        'conversion_wait_seconds': conversion_waited,
+        'interception': None,
+        'download': download_stats.to_dict(),
+        'timings': timer.timings,
+    }
@@ -0,0 +1,281 @@
+import logging
+import math
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+from audio_store import audio_path, find_screenshot
+from metrics import BACKEND_ATTEMPTS, BACKEND_LINK_SECONDS, HEDGES
+from pipeline import run_conversion
+from sites import CONVERTER_SITE, get_site, sites
+
+# Hedged conversions: when the primary converter site hasn't produced a download link by
+# its usual deadline, the next site starts in parallel on another browser worker and the
+# first success wins. Needs BROWSER_POOL_SIZE >= 2 for hedges; with one browser only the
+# failover to the next site after a failure applies.
+CONVERTER_HEDGING = os.environ.get('CONVERTER_HEDGING', '0') == '1'
+# Sites taking part, most preferred first (default: every site in sites.json, CONVERTER_SITE first)
+CONVERTER_BACKENDS = [name.strip() for name in os.environ.get('CONVERTER_BACKENDS', '').split(',') if name.strip()]
+# The hedge starts once the primary has gone this percentile of its recent time-to-link without a link
+HEDGE_PERCENTILE = float(os.environ.get('HEDGE_PERCENTILE', 90))
+# Hedge deadline used until a site has HEDGE_MIN_SAMPLES timings, and the floor applied after
+HEDGE_DEFAULT_DELAY = float(os.environ.get('HEDGE_DEFAULT_DELAY', 20))
+HEDGE_MIN_DELAY = float(os.environ.get('HEDGE_MIN_DELAY', 3))
+HEDGE_MIN_SAMPLES = int(os.environ.get('HEDGE_MIN_SAMPLES', 5))
+# Recent attempts per site that success rates and latencies are computed from
+BACKEND_WINDOW = int(os.environ.get('BACKEND_WINDOW', 50))
+
+
+def percentile(values, pct):
+    # Nearest-rank percentile of a non-empty sample
+    ordered = sorted(values)
+    return ordered[max(math.ceil(pct / 100 * len(ordered)), 1) - 1]
+
+
+class BackendStats:
+    # Sliding window of one site's recent attempts. Only attempts that actually reached
+    # a download link contribute latency samples - a cancelled attempt's running time is
+    # just a lower bound and would make a site that always loses look fast. Cancelled
+    # attempts don't count towards the success rate either.
+
+    def __init__(self, name, window=BACKEND_WINDOW):
+        self.name = name
+        self.outcomes = deque(maxlen=window)
+        self.link_seconds = deque(maxlen=window)
+        self.cancelled = 0
+
+    def record(self, outcome, seconds=None):
+        if outcome == 'cancelled':
+            self.cancelled += 1
+        else:
+            self.outcomes.append(outcome == 'success')
+        if seconds is not None:
+            self.link_seconds.append(seconds)
+
+    def success_rate(self):
+        # Smoothed so a site without history is neither trusted nor written off
+        return (sum(self.outcomes) + 1) / (len(self.outcomes) + 2)
+
+    def typical_seconds(self):
+        return percentile(self.link_seconds, 50) if self.link_seconds else HEDGE_DEFAULT_DELAY
+
+    def expected_seconds(self):
+        # Rough cost of trying this site first: median time to a link, inflated by failures
+        return self.typical_seconds() / self.success_rate()
+
+    def hedge_delay(self):
+        if len(self.link_seconds) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        return max(HEDGE_MIN_DELAY, percentile(self.link_seconds, HEDGE_PERCENTILE))
+
+    def to_dict(self):
+        return {
+            'attempts': len(self.outcomes),
+            'successes': sum(self.outcomes),
+            'cancelled': self.cancelled,
+            'success_rate': round(sum(self.outcomes) / len(self.outcomes), 3) if self.outcomes else None,
+            'p50_link_seconds': round(percentile(self.link_seconds, 50), 2) if self.link_seconds else None,
+            'hedge_delay': round(self.hedge_delay(), 2),
+        }
+
+
+class BackendTracker:
+    # Per-site success rates and link latencies; picks the primary for each conversion
+
+    def __init__(self, names):
+        self.names = list(names)
+        self._stats = {name: BackendStats(name) for name in self.names}
+        self._lock = threading.Lock()
+
+    def ranked(self):
+        # Cheapest expected site first; configured order breaks ties
+        with self._lock:
+            return sorted(self.names, key=lambda name: (self._stats[name].expected_seconds(), self.names.index(name)))
+
+    def hedge_delay(self, name):
+        with self._lock:
+            return self._stats[name].hedge_delay()
+
+    def record(self, name, outcome, seconds=None):
+        BACKEND_ATTEMPTS.labels(name, outcome).inc()
+        if seconds is not None and outcome != 'cancelled':
+            BACKEND_LINK_SECONDS.labels(name).observe(seconds)
+        with self._lock:
+            self._stats[name].record(outcome, seconds)
+
+    def stats(self):
+        ranked = self.ranked()
+        with self._lock:
+            return {
+                'hedging': CONVERTER_HEDGING,
+                'primary': ranked[0],
+                'sites': {name: self._stats[name].to_dict() for name in self.names},
+            }
+
+
+def _default_backends():
+    names = CONVERTER_BACKENDS or [CONVERTER_SITE] + [name for name in sites if name != CONVERTER_SITE]
+    unknown = [name for name in names if name not in sites]
+    if unknown:
+        logging.warning(f"Ignoring unknown converter sites in CONVERTER_BACKENDS: {', '.join(unknown)}")
+    return [name for name in names if name in sites] or [CONVERTER_SITE]
+
+
+backends = BackendTracker(_default_backends())
+
+
+class Attempt:
+    # One site's run within a hedged conversion, writing to its own spool id
+
+    def __init__(self, site, role, output_id):
+        self.site = site
+        self.role = role
+        self.output_id = output_id
+        self.started_at = time.time()
+        self.link_at = None
+        self.outcome = None
+        self.future = None
+
+    def link_seconds(self):
+        return self.link_at - self.started_at if self.link_at is not None else None
+
+    def to_dict(self):
+        seconds = self.link_seconds()
+        return {
+            'site': self.site.name,
+            'role': self.role,
+            'outcome': self.outcome,
+            'link_seconds': round(seconds, 2) if seconds is not None else None,
+        }
+
+
+def _discard_files(attempt):
+    for path in (audio_path(attempt.output_id), (find_screenshot(attempt.output_id) or (None,))[0]):
+        if path and os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError as e:
+                logging.warning(f"Could not remove {path}: {e}")
+
+
+def _promote_files(attempt, output_id, result):
+    # Moves an attempt's audio and screenshot to the job's own id, where /audio/<id> and
+    # /screenshot/<id> look for them
+    if result is not None and result.get('audio_downloaded'):
+        os.replace(audio_path(attempt.output_id), audio_path(output_id))
+    found = find_screenshot(attempt.output_id)
+    if found is not None:
+        path = found[0]
+        os.replace(path, os.path.join(os.path.dirname(path), output_id + os.path.splitext(path)[1]))
+    if result is not None and result.get('screenshot_url'):
+        result['screenshot_url'] = f'/screenshot/{output_id}'
+
+
+def convert_hedged(pool, url, output_id, screenshot_options, progress=None, timeout=None):
+    # Runs run_conversion on the best-ranked site and hedges onto the next one when no
+    # download link shows up in time (or fails over straight away if the primary fails).
+    # The first attempt that downloads audio wins; the others are cancelled.
+    names = backends.ranked()
+    # Standby pages are only useful for the site jobs start on
+    pool.set_standby_site(names[0])
+    deadline = time.time() + timeout if timeout else None
+    finished = queue.Queue()
+    attempts = []
+
+    def launch(name, role):
+        site = get_site(name)
+        attempt = Attempt(site, role, f'{output_id}-{len(attempts) + 1}')
+
+        def report(stage, **data):
+            if stage == 'launching':
+                attempt.started_at = time.time()
+            elif stage == 'download' and attempt.link_at is None:
+                attempt.link_at = time.time()
+            if progress is not None:
+                progress(stage, backend=site.name, **data)
+
+        attempt.future = pool.submit(run_conversion, url, attempt.output_id, screenshot_options, site, progress=report)
+        attempt.future.add_done_callback(lambda _future: finished.put(attempt))
+        attempts.append(attempt)
+        return attempt
+
+    def running():
+        return [attempt for attempt in attempts if attempt.outcome is None]
+
+    def cancel_running():
+        for attempt in running():
+            attempt.outcome = 'cancelled'
+            pool.cancel(attempt.future)
+            # Whatever the loser still writes is thrown away once it stops
+            attempt.future.add_done_callback(lambda _future, loser=attempt: _discard_files(loser))
+            backends.record(attempt.site.name, 'cancelled', attempt.link_seconds())
+
+    remaining = names[1:]
+    primary = launch(names[0], 'primary')
+    hedge_at = time.time() + backends.hedge_delay(primary.site.name) if CONVERTER_HEDGING and remaining else None
+    last_result, last_error, last_attempt = None, None, None
+    while running():
+        now = time.time()
+        waits = [when - now for when in (hedge_at, deadline) if when is not None]
+        try:
+            attempt = finished.get(timeout=max(0, min(waits)) if waits else None)
+        except queue.Empty:
+            if deadline is not None and time.time() >= deadline:
+                cancel_running()
+                raise TimeoutError(f'No converter site finished within {timeout:g}s')
+            if any(attempt.link_at is not None for attempt in running()):
+                # A download is already under way - a second site can't beat it
+                hedge_at = None
+            elif not pool.idle():
+                # Hedging only pays off on a free browser; look again shortly
+                hedge_at = time.time() + 1
+            else:
+                hedge_site = get_site(remaining.pop(0))
+                hedge_at = None
+                logging.info(f"🔀 No download link from {primary.site.host} after "
+                             f"{time.time() - primary.started_at:.1f}s, hedging on {hedge_site.host}")
+                if progress is not None:
+                    progress('hedge', backend=hedge_site.name, site=hedge_site.host)
+                launch(hedge_site.name, 'hedge')
+            continue
+
+        if attempt.outcome == 'cancelled':
+            continue
+        try:
+            result, error = attempt.future.result(), None
+        except Exception as e:
+            result, error = None, e
+        seconds = attempt.link_seconds()
+        if result is not None and result.get('audio_downloaded'):
+            attempt.outcome = 'success'
+            backends.record(attempt.site.name, 'success', seconds)
+            cancel_running()
+            _promote_files(attempt, output_id, result)
+            if len(attempts) > 1:
+                HEDGES.labels(attempt.role).inc()
+                logging.info(f"🏁 {attempt.site.host} ({attempt.role}) won the hedged conversion")
+            result['backends'] = [a.to_dict() for a in attempts]
+            return result
+
+        attempt.outcome = 'failure'
+        backends.record(attempt.site.name, 'failure', seconds)
+        logging.warning(f"⚠️ Conversion on {attempt.site.host} ({attempt.role}) failed: "
+                        f"{error or result.get('message')}")
+        if last_attempt is not None:
+            _discard_files(last_attempt)
+        last_result, last_error, last_attempt = result, error, attempt
+        if remaining and not running():
+            # Nothing left in flight - fail over to the next site right away
+            launch(remaining.pop(0), 'failover')
+            hedge_at = None
+
+    if len(attempts) > 1:
+        HEDGES.labels('none').inc()
+    # Keep the last failure's screenshot (and partial result) for debugging
+    _promote_files(last_attempt, output_id, last_result)
+    if last_error is not None:
+        raise last_error
+    last_result['backends'] = [a.to_dict() for a in attempts]
+    return last_result
@@ -0,0 +1,316 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from urllib.parse import urlparse
+
+# Declarative blocking rules - see interception_policy.json
+INTERCEPTION_POLICY_FILE = os.environ.get(
+    'INTERCEPTION_POLICY_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'interception_policy.json')
+)
+# Local copies of the converter site's JS/CSS, served with route.fulfill
+STATIC_CACHE_DIR = os.environ.get('STATIC_CACHE_DIR', os.path.expanduser('~/.cache/chromium-launcher/static'))
+# Cached assets are served without asking the network for as long as their own
+# Cache-Control max-age allows, but never longer than this; after that (or straight away
+# for no-cache or no max-age) they are revalidated with If-None-Match / If-Modified-Since
+STATIC_CACHE_MAX_AGE = float(os.environ.get('STATIC_CACHE_MAX_AGE', 3600))
+STATIC_CACHE_MAX_BYTES = int(os.environ.get('STATIC_CACHE_MAX_BYTES', 50 * 1024 * 1024))
+# The whole cache is dropped on this schedule (0 disables), so assets the site stopped
+# using don't linger until the size cap pushes them out
+STATIC_CACHE_FLUSH_INTERVAL = float(os.environ.get('STATIC_CACHE_FLUSH_INTERVAL', 24 * 3600))
+STATIC_CACHE_ENABLED = os.environ.get('STATIC_CACHE_ENABLED', '1') == '1'
+
+# Used when the policy file is missing
+DEFAULT_POLICY = {
+    'block_resource_types': ['image', 'media', 'font'],
+    'block_domains': [],
+    'block_url_patterns': [],
+    'cache_resource_types': ['script', 'stylesheet'],
+}
+
+# Headers that describe the wire encoding rather than the (already decoded) body
+HOP_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding', 'connection')
+# Never replayed from the cache - a cookie set for one session must not leak into the next
+UNCACHED_HEADERS = HOP_HEADERS + ('set-cookie',)
+
+
+class InterceptionPolicy:
+    def __init__(self, block_resource_types=(), block_domains=(), block_url_patterns=(), cache_resource_types=()):
+        self.block_resource_types = set(block_resource_types)
+        self.block_domains = tuple(d.lower().lstrip('.') for d in block_domains)
+        self.block_url_patterns = [re.compile(p, re.IGNORECASE) for p in block_url_patterns]
+        self.cache_resource_types = set(cache_resource_types)
+
+    @classmethod
+    def from_file(cls, path=INTERCEPTION_POLICY_FILE):
+        config = dict(DEFAULT_POLICY)
+        try:
+            with open(path) as f:
+                config.update(json.load(f))
+            logging.info(f"Loaded interception policy from {path}")
+        except FileNotFoundError:
+            logging.info(f"No interception policy at {path}, using defaults")
+        return cls(
+            block_resource_types=config['block_resource_types'],
+            block_domains=config['block_domains'],
+            block_url_patterns=config['block_url_patterns'],
+            cache_resource_types=config['cache_resource_types'],
+        )
+
+    def _blocked_domain(self, host):
+        return any(host == d or host.endswith('.' + d) for d in self.block_domains)
+
+    def decide(self, url, resource_type):
+        # Returns ('block', reason), ('cache', None) or ('continue', None)
+        if resource_type in self.block_resource_types:
+            return 'block', 'resource_type'
+        host = (urlparse(url).hostname or '').lower()
+        if self._blocked_domain(host):
+            return 'block', 'domain'
+        if any(pattern.search(url) for pattern in self.block_url_patterns):
+            return 'block', 'url_pattern'
+        if resource_type in self.cache_resource_types:
+            return 'cache', None
+        return 'continue', None
+
+
+def cache_control(headers):
+    # Cache-Control directives as a dict: 'max-age=60, no-cache' -> {'max-age': '60', 'no-cache': None}
+    value = next((v for k, v in headers.items() if k.lower() == 'cache-control'), '')
+    directives = {}
+    for part in value.split(','):
+        name, _, argument = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = argument.strip('"') or None
+    return directives
+
+
+def storable(status, headers):
+    # Every context shares this cache, so only responses meant for shared caches go in
+    if status != 200 or any(k.lower() == 'set-cookie' for k in headers):
+        return False
+    directives = cache_control(headers)
+    return 'no-store' not in directives and 'private' not in directives
+
+
+def freshness_lifetime(headers, max_age=STATIC_CACHE_MAX_AGE):
+    # Seconds a stored response may be served without revalidation
+    directives = cache_control(headers)
+    if 'no-cache' in directives:
+        return 0
+    lifetime = directives.get('s-maxage') or directives.get('max-age')
+    try:
+        return min(max(int(lifetime), 0), max_age)
+    except (TypeError, ValueError):
+        return 0
+
+
+class StaticAssetCache:
+    # On-disk copy of cacheable GET responses: <sha256>.body plus <sha256>.json metadata.
+    # Shared by every browser worker process; the mtime of a .generation marker says
+    # when the cache was last flushed.
+
+    def __init__(self, directory=STATIC_CACHE_DIR, max_age=STATIC_CACHE_MAX_AGE, max_bytes=STATIC_CACHE_MAX_BYTES,
+                 flush_interval=STATIC_CACHE_FLUSH_INTERVAL):
+        self.directory = directory
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.generation_path = os.path.join(directory, '.generation')
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        if not os.path.exists(self.generation_path):
+            self._start_generation()
+
+    def _start_generation(self):
+        with open(self.generation_path, 'w') as f:
+            f.write(str(time.time()))
+
+    def _flush_if_due(self):
+        if not self.flush_interval:
+            return
+        try:
+            age = time.time() - os.path.getmtime(self.generation_path)
+        except OSError:
+            age = None
+        if age is not None and age < self.flush_interval:
+            return
+        with self._lock:
+            for name in os.listdir(self.directory):
+                if name.endswith(('.body', '.json')):
+                    try:
+                        os.remove(os.path.join(self.directory, name))
+                    except OSError:
+                        pass
+            self._start_generation()
+        logging.info(f"🧹 Flushed the static asset cache (scheduled every {self.flush_interval:.0f}s)")
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        base = os.path.join(self.directory, key)
+        return base + '.body', base + '.json'
+
+    def load(self, url):
+        self._flush_if_due()
+        body_path, meta_path = self._paths(url)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            with open(body_path, 'rb') as f:
+                body = f.read()
+        except (OSError, ValueError):
+            return None, None
+        return meta, body
+
+    def store(self, url, status, headers, body):
+        body_path, meta_path = self._paths(url)
+        meta = {
+            'url': url,
+            'status': status,
+            'headers': {k: v for k, v in headers.items() if k.lower() not in UNCACHED_HEADERS},
+            'stored_at': time.time(),
+            'fresh_for': freshness_lifetime(headers, self.max_age),
+        }
+        try:
+            with open(body_path + '.tmp', 'wb') as f:
+                f.write(body)
+            os.replace(body_path + '.tmp', body_path)
+            with open(meta_path + '.tmp', 'w') as f:
+                json.dump(meta, f)
+            os.replace(meta_path + '.tmp', meta_path)
+        except OSError as e:
+            logging.warning(f"Could not cache static asset {url[:100]}: {e}")
+            return
+        self._evict()
+
+    def touch(self, url, headers):
+        # Revalidated - the copy is fresh again, for as long as the 304's headers say
+        _, meta_path = self._paths(url)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            meta['stored_at'] = time.time()
+            meta['fresh_for'] = freshness_lifetime(dict(meta['headers'], **headers), self.max_age)
+            with open(meta_path + '.tmp', 'w') as f:
+                json.dump(meta, f)
+            os.replace(meta_path + '.tmp', meta_path)
+        except (OSError, ValueError):
+            pass
+
+    def _evict(self):
+        with self._lock:
+            bodies = []
+            for name in os.listdir(self.directory):
+                if name.endswith('.body'):
+                    path = os.path.join(self.directory, name)
+                    try:
+                        bodies.append((os.path.getmtime(path), os.path.getsize(path), path))
+                    except OSError:
+                        continue
+            total = sum(size for _, size, _ in bodies)
+            for _, size, path in sorted(bodies):
+                if total <= self.max_bytes:
+                    break
+                for stale in (path, path[:-len('.body')] + '.json'):
+                    try:
+                        os.remove(stale)
+                    except OSError:
+                        pass
+                total -= size
+
+
+class InterceptionStats:
+    # Per-run counters reported with each job result
+
+    def __init__(self):
+        self.blocked = {'resource_type': 0, 'domain': 0, 'url_pattern': 0}
+        self.cache_fresh_hits = 0
+        self.cache_revalidated_hits = 0
+        self.cache_misses = 0
+        self.cache_served_bytes = 0
+        self.network_bytes = 0
+
+    def to_dict(self):
+        return {
+            'blocked_requests': sum(self.blocked.values()),
+            'blocked_by': dict(self.blocked),
+            'cache_fresh_hits': self.cache_fresh_hits,
+            'cache_revalidated_hits': self.cache_revalidated_hits,
+            'cache_misses': self.cache_misses,
+            'cache_served_bytes': self.cache_served_bytes,
+            'network_bytes': self.network_bytes,
+        }
+
+
+policy = InterceptionPolicy.from_file()
+static_cache = StaticAssetCache() if STATIC_CACHE_ENABLED else None
+
+
+def _fulfill_from_cache(route, meta, body, stats):
+    # Entries written before Set-Cookie was stripped on store must not replay it either
+    headers = {k: v for k, v in meta['headers'].items() if k.lower() not in UNCACHED_HEADERS}
+    route.fulfill(status=meta['status'], headers=headers, body=body)
+    stats.cache_served_bytes += len(body)
+
+
+def _handle_cacheable(route, request, stats):
+    meta, body = static_cache.load(request.url)
+    if meta is not None and time.time() - meta['stored_at'] < meta.get('fresh_for', 0):
+        stats.cache_fresh_hits += 1
+        _fulfill_from_cache(route, meta, body, stats)
+        return
+
+    # Stale or missing - ask the server, letting it answer 304 if our copy is unchanged
+    headers = dict(request.headers)
+    if meta is not None:
+        etag = meta['headers'].get('etag')
+        last_modified = meta['headers'].get('last-modified')
+        if etag:
+            headers['if-none-match'] = etag
+        if last_modified:
+            headers['if-modified-since'] = last_modified
+
+    response = route.fetch(headers=headers)
+    if response.status == 304 and meta is not None:
+        stats.cache_revalidated_hits += 1
+        static_cache.touch(request.url, response.headers)
+        _fulfill_from_cache(route, meta, body, stats)
+        return
+
+    stats.cache_misses += 1
+    fresh_body = response.body()
+    stats.network_bytes += len(fresh_body)
+    response_headers = {k: v for k, v in response.headers.items() if k.lower() not in HOP_HEADERS}
+    if storable(response.status, response.headers):
+        static_cache.store(request.url, response.status, response_headers, fresh_body)
+    route.fulfill(status=response.status, headers=response_headers, body=fresh_body)
+
+
+def install(page):
+    # Routes every request on the page through the policy; returns the run's counters
+    stats = InterceptionStats()
+
+    def handle(route):
+        request = route.request
+        try:
+            action, reason = policy.decide(request.url, request.resource_type)
+            if action == 'block':
+                stats.blocked[reason] += 1
+                route.abort()
+            elif action == 'cache' and static_cache is not None and request.method == 'GET':
+                _handle_cacheable(route, request, stats)
+            else:
+                route.continue_()
+        except Exception as e:
+            # Never let the interceptor break the page - fall back to the network
+            logging.warning(f"Interception failed for {request.url[:100]}: {e}")
+            try:
+                route.continue_()
+            except Exception:
+                pass
+
+    page.route("**/*", handle)
+    return stats
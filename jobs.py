@@ -0,0 +1,249 @@
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+# Maximum number of jobs waiting for a worker before new submissions are refused
+JOB_QUEUE_SIZE = int(os.environ.get('JOB_QUEUE_SIZE', 20))
+# Number of background workers draining the queue (0 = one per browser worker)
+JOB_CONCURRENCY = int(os.environ.get('JOB_CONCURRENCY', 0))
+# How long finished jobs (and their results) are kept around for polling
+JOB_RESULT_TTL = float(os.environ.get('JOB_RESULT_TTL', 600))
+
+FINISHED_STATES = ('done', 'failed', 'cancelled')
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, url, key=None, options=None, job_id=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.url = url
+        self.key = key
+        self.options = options or {}
+        # Number of requests sharing this job (single-flight coalescing)
+        self.waiters = 1
+        self.status = 'queued'
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        # Progress events for /jobs/<id>/events, numbered from 1
+        self.events = []
+        self._changed = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    def emit(self, stage, **data):
+        # Records one progress event and wakes every stream waiting on this job
+        with self._changed:
+            self.events.append(dict(data, id=len(self.events) + 1, stage=stage, time=round(time.time(), 3)))
+            self._changed.notify_all()
+
+    def events_after(self, last_id, timeout=None):
+        # Events newer than last_id, waiting up to `timeout` for the next one
+        with self._changed:
+            if len(self.events) <= last_id:
+                self._changed.wait(timeout)
+            return self.events[last_id:]
+
+    def to_dict(self, position=None):
+        data = {
+            'job_id': self.id,
+            'url': self.url,
+            'status': self.status,
+            'waiters': self.waiters,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+        if position is not None:
+            data['position'] = position
+        if self.finished_at and self.started_at:
+            data['duration'] = round(self.finished_at - self.started_at, 2)
+        if self.status == 'done':
+            data['result'] = self.result
+        elif self.status == 'failed':
+            data['error'] = self.error
+        return data
+
+
+class JobQueue:
+    # Bounded FIFO of conversion jobs drained by a fixed set of worker threads.
+    # `handler` is called with the Job and its return value becomes job.result; it
+    # may report progress with job.emit(stage, **data) between the queue's own events.
+    # Jobs submitted with the same key while one is queued or running share it.
+    # `admission` (optional) gates new jobs: check() may refuse a submission and
+    # wait_for_headroom(busy) may hold a queued job back before it starts.
+
+    def __init__(self, handler, concurrency=JOB_CONCURRENCY, maxsize=JOB_QUEUE_SIZE, result_ttl=JOB_RESULT_TTL,
+                 admission=None):
+        self.handler = handler
+        self.admission = admission
+        self.concurrency = max(1, concurrency)
+        self.maxsize = max(1, maxsize)
+        self.result_ttl = result_ttl
+        self._queue = queue.Queue(maxsize=self.maxsize)
+        self._jobs = {}
+        self._waiting = []
+        self._inflight = {}
+        self._running = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._workers = []
+
+    def start(self):
+        with self._lock:
+            if self._workers:
+                return
+            logging.info(f"Starting {self.concurrency} job worker(s), queue capacity {self.maxsize}")
+            for index in range(self.concurrency):
+                worker = threading.Thread(target=self._work, name=f'job-worker-{index}', daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def submit(self, url, key=None, options=None):
+        self.start()
+        self._prune()
+        with self._lock:
+            existing = self._inflight.get(key) if key else None
+            if existing is not None and not existing.finished:
+                # Single-flight: attach to the conversion that is already queued or running
+                existing.waiters += 1
+                self.coalesced += 1
+                logging.info(f"🔗 Request for {key} joined in-flight job {existing.id} ({existing.waiters} waiters)")
+                return existing
+
+            if self.admission is not None:
+                self.admission.check()
+            job = Job(url, key, options)
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                raise QueueFullError(f'Job queue is full ({self.maxsize} jobs waiting)')
+            self._jobs[job.id] = job
+            self._waiting.append(job.id)
+            if key:
+                self._inflight[key] = job
+            job.emit('queued', position=len(self._waiting))
+        logging.info(f"📥 Job {job.id} queued for {url} (position {self.position(job)})")
+        return job
+
+    def add_finished(self, url, result, job_id=None):
+        # Records a job that was answered without running (e.g. from the result cache) so
+        # /jobs/<id> and its event stream work as usual. Takes no queue slot and skips admission.
+        self._prune()
+        job = Job(url, job_id=job_id)
+        job.status = 'done'
+        job.started_at = job.finished_at = job.created_at
+        job.result = result
+        with self._lock:
+            self._jobs[job.id] = job
+        job.emit('done', result=result)
+        logging.info(f"⚡ Job {job.id} answered immediately for {url}")
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def position(self, job):
+        # 1-based place in line, or None once a worker has picked the job up
+        with self._lock:
+            try:
+                return self._waiting.index(job.id) + 1
+            except ValueError:
+                return None
+
+    def cancel(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status != 'queued':
+                return False
+            if job.waiters > 1:
+                # Other requests still want this result - just detach this one
+                job.waiters -= 1
+                logging.info(f"🔗 One waiter left job {job_id} ({job.waiters} remaining)")
+                return True
+            job.status = 'cancelled'
+            job.finished_at = time.time()
+            self._waiting.remove(job.id)
+            self._release_key(job)
+            self._announce_positions()
+        job.emit('cancelled')
+        logging.info(f"🚫 Job {job_id} cancelled before it started")
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queued': len(self._waiting),
+                'running': self._running,
+                'capacity': self.maxsize,
+                'concurrency': self.concurrency,
+                'inflight_keys': len(self._inflight),
+                'coalesced': self.coalesced,
+            }
+
+    def _release_key(self, job):
+        # Caller holds the lock
+        if job.key and self._inflight.get(job.key) is job:
+            del self._inflight[job.key]
+
+    def _announce_positions(self):
+        # Caller holds the lock. Everyone still waiting moved up a place.
+        for position, job_id in enumerate(self._waiting, start=1):
+            self._jobs[job_id].emit('queued', position=position)
+
+    def _prune(self):
+        cutoff = time.time() - self.result_ttl
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished and job.finished_at < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job.status != 'cancelled' and self.admission is not None:
+                self.admission.wait_for_headroom(busy=lambda: self._running > 0)
+            with self._lock:
+                if job.status == 'cancelled':
+                    continue
+                self._waiting.remove(job.id)
+                self._running += 1
+                job.status = 'running'
+                job.started_at = time.time()
+                self._announce_positions()
+            job.emit('started')
+
+            logging.info(f"▶️ Job {job.id} started ({job.url})")
+            try:
+                result = self.handler(job)
+                status = 'done'
+            except Exception as e:
+                logging.error(f"Job {job.id} failed: {e}", exc_info=True)
+                job.error = str(e) or e.__class__.__name__
+                result = None
+                status = 'failed'
+
+            with self._lock:
+                job.result = result
+                job.finished_at = time.time()
+                job.status = status
+                self._running -= 1
+                self._release_key(job)
+            if status == 'done':
+                job.emit('done', result=result)
+            else:
+                job.emit('failed', error=job.error)
+            logging.info(f"⏹️ Job {job.id} {job.status} in {job.finished_at - job.started_at:.2f}s"
+                         f" ({job.waiters} waiter(s) served)")
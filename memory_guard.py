@@ -0,0 +1,137 @@
+import logging
+import os
+import threading
+import time
+
+from metrics import process_tree_rss
+
+# Memory available to this service. Defaults to the container's cgroup limit, then to
+# the machine's total memory; set it explicitly if neither reflects the real budget.
+MEMORY_LIMIT_BYTES = int(os.environ.get('MEMORY_LIMIT_BYTES', 0))
+# Queued jobs only start while the process tree stays below this fraction of the limit
+MEMORY_ADMIT_FRACTION = float(os.environ.get('MEMORY_ADMIT_FRACTION', 0.75))
+# Above this fraction new requests are refused outright with 503 + Retry-After
+MEMORY_SHED_FRACTION = float(os.environ.get('MEMORY_SHED_FRACTION', 0.9))
+# Expected growth of one running conversion (page, renderer and download buffers)
+MEMORY_JOB_ESTIMATE = int(os.environ.get('MEMORY_JOB_ESTIMATE', 150 * 1024 * 1024))
+# /proc is scanned at most this often; everything in between reuses the last sample
+MEMORY_SAMPLE_INTERVAL = float(os.environ.get('MEMORY_SAMPLE_INTERVAL', 1.0))
+# Retry-After sent with memory-pressure 503s
+MEMORY_RETRY_AFTER = int(os.environ.get('MEMORY_RETRY_AFTER', 15))
+
+# cgroup v2 first, then v1; v1 reports "unlimited" as a huge number
+CGROUP_LIMIT_FILES = ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes')
+
+
+class MemoryPressureError(Exception):
+    def __init__(self, message, retry_after=MEMORY_RETRY_AFTER):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _total_memory():
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemTotal:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def detect_memory_limit():
+    total = _total_memory()
+    for path in CGROUP_LIMIT_FILES:
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value.isdigit() and (not total or int(value) < total):
+            return int(value)
+    return total
+
+
+class MemoryGuard:
+    # Admission control based on the resident memory of this process and its
+    # Chromium/driver children
+
+    def __init__(self, limit=MEMORY_LIMIT_BYTES, admit_fraction=MEMORY_ADMIT_FRACTION,
+                 shed_fraction=MEMORY_SHED_FRACTION, job_estimate=MEMORY_JOB_ESTIMATE,
+                 sample_interval=MEMORY_SAMPLE_INTERVAL):
+        self.limit = limit or detect_memory_limit()
+        self.admit_fraction = admit_fraction
+        self.shed_fraction = shed_fraction
+        self.job_estimate = job_estimate
+        self.sample_interval = sample_interval
+        self.shed = 0
+        self.delayed = 0
+        self._sample = {}
+        self._sampled_at = 0
+        self._lock = threading.Lock()
+        if self.limit:
+            logging.info(f"Memory guard: limit {self.limit / (1024 * 1024):.0f}MB, "
+                         f"admit below {admit_fraction:.0%}, shed above {shed_fraction:.0%}")
+        else:
+            logging.warning("Memory guard: could not determine a memory limit, admission control disabled")
+
+    def sample(self, max_age=None):
+        max_age = self.sample_interval if max_age is None else max_age
+        with self._lock:
+            if time.time() - self._sampled_at >= max_age:
+                self._sample = process_tree_rss()
+                self._sampled_at = time.time()
+            return dict(self._sample)
+
+    def usage(self, max_age=None):
+        return sum(self.sample(max_age).values())
+
+    def check(self, estimate=None):
+        # Refuses new work when memory is already close to the limit
+        if not self.limit:
+            return
+        usage = self.usage()
+        expected = usage + (self.job_estimate if estimate is None else estimate)
+        if usage > self.limit * self.shed_fraction or expected > self.limit:
+            with self._lock:
+                self.shed += 1
+            raise MemoryPressureError(
+                f'Memory is tight ({usage / (1024 * 1024):.0f}MB of {self.limit / (1024 * 1024):.0f}MB in use)'
+            )
+
+    def has_headroom(self, estimate=None):
+        if not self.limit:
+            return True
+        expected = self.usage() + (self.job_estimate if estimate is None else estimate)
+        return expected <= self.limit * self.admit_fraction
+
+    def wait_for_headroom(self, busy):
+        # Holds a queued job back while memory is tight. `busy()` says whether other
+        # jobs are still running - with nothing running, waiting can't free anything,
+        # so the job starts regardless.
+        waited = False
+        while busy() and not self.has_headroom():
+            if not waited:
+                waited = True
+                with self._lock:
+                    self.delayed += 1
+                logging.info(f"⏳ Delaying job start: {self.usage() / (1024 * 1024):.0f}MB in use")
+            time.sleep(self.sample_interval)
+        return waited
+
+    def stats(self):
+        sample = self.sample()
+        return {
+            'limit': self.limit,
+            'usage': sum(sample.values()),
+            'by_process': sample,
+            'admit_below': int(self.limit * self.admit_fraction),
+            'shed_above': int(self.limit * self.shed_fraction),
+            'job_estimate': self.job_estimate,
+            'shed': self.shed,
+            'delayed': self.delayed,
+        }
+
+
+memory_guard = MemoryGuard()
@@ -0,0 +1,154 @@
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# Stage latencies range from tens of milliseconds (form fill) to a minute (conversion wait)
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 45, 60, 90, 120)
+
+STAGE_SECONDS = Histogram(
+    'converter_stage_seconds', 'Time spent in each conversion pipeline stage', ['stage'], buckets=STAGE_BUCKETS
+)
+JOB_SECONDS = Histogram(
+    'converter_job_seconds', 'End-to-end conversion latency by outcome', ['outcome'], buckets=STAGE_BUCKETS
+)
+JOBS = Counter('converter_jobs', 'Finished conversions by outcome', ['outcome'])
+REJECTIONS = Counter('converter_rejections', 'Requests turned away before any work was done', ['reason'])
+COALESCED = Counter('converter_coalesced_requests', 'Requests that joined an in-flight job for the same video')
+CONVERSION_PATHS = Counter(
+    'converter_conversion_paths', 'Conversions by the path that served them (http, browser, browser_fallback)', ['path']
+)
+DOWNLOAD_BYTES = Counter('converter_download_bytes', 'Audio bytes downloaded from converter sites')
+DOWNLOAD_RETRIES = Counter('converter_download_retries', 'Download requests retried after a failure')
+DOWNLOAD_THROUGHPUT = Histogram(
+    'converter_download_throughput_bytes', 'Per-file download throughput in bytes per second',
+    buckets=(64e3, 256e3, 1e6, 2.5e6, 5e6, 10e6, 25e6, 50e6, 100e6)
+)
+CACHE_LOOKUPS = Counter('converter_result_cache_lookups', 'Result cache lookups', ['result'])
+BACKEND_ATTEMPTS = Counter(
+    'converter_backend_attempts', 'Conversion attempts per converter site by outcome (success, failure, cancelled)',
+    ['site', 'outcome']
+)
+BACKEND_LINK_SECONDS = Histogram(
+    'converter_backend_link_seconds', 'Time until a converter site produced a download link', ['site'],
+    buckets=STAGE_BUCKETS
+)
+HEDGES = Counter('converter_hedges', 'Multi-site conversions by the attempt that won (primary, hedge, failover, none)', ['winner'])
+
+QUEUE_DEPTH = Gauge('converter_queue_depth', 'Jobs waiting for a worker')
+JOBS_RUNNING = Gauge('converter_jobs_running', 'Jobs currently being converted')
+BROWSERS_HEALTHY = Gauge('converter_browsers_healthy', 'Warm browsers that are connected and ready')
+RSS_BYTES = Gauge('converter_rss_bytes', 'Resident memory by process group', ['process'])
+CACHE_BYTES = Gauge('converter_result_cache_bytes', 'Bytes held by the result cache')
+
+
+class StageTimer:
+    # Collects per-stage durations for one run; returned with the job result as 'timings'
+
+    def __init__(self):
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start_time
+            self.timings[name] = round(self.timings.get(name, 0) + elapsed, 3)
+
+
+def observe_stages(timings):
+    for stage, seconds in timings.items():
+        STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+def observe_download(download):
+    if not download:
+        return
+    DOWNLOAD_BYTES.inc(download['size'])
+    DOWNLOAD_RETRIES.inc(download['retries'])
+    if download['throughput']:
+        DOWNLOAD_THROUGHPUT.observe(download['throughput'])
+
+
+def job_outcome(result):
+    if result.get('cached'):
+        return 'cached'
+    if result.get('conversion_state') == 'error':
+        return 'converter_error'
+    if result.get('audio_downloaded'):
+        return 'success'
+    if result.get('download_button_clickable'):
+        return 'download_failed'
+    if result.get('download_button_found'):
+        return 'button_not_clickable'
+    return 'button_not_found'
+
+
+def record_job(outcome, seconds):
+    JOBS.labels(outcome).inc()
+    JOB_SECONDS.labels(outcome).observe(seconds)
+
+
+def _classify(pid, comm):
+    comm = comm.lower()
+    if comm.startswith('python'):
+        try:
+            with open(f'/proc/{pid}/cmdline', 'rb') as f:
+                if b'browser_worker' in f.read():
+                    return 'browser_worker'
+        except OSError:
+            pass
+    if 'chrom' in comm or 'headless' in comm:
+        return 'chromium'
+    # Recent Node releases name their main thread, which is what comm reports for the driver
+    if comm in ('node', 'mainthread'):
+        return 'playwright_driver'
+    return 'other'
+
+
+def process_rss(pid):
+    # Resident bytes of a single process, 0 if it is gone
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def process_tree_rss(root_pid=None):
+    # RSS of a process (this one by default) and all of its descendants, grouped; read straight from /proc
+    if not os.path.isdir('/proc'):
+        return {}
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    children = {}
+    info = {}
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        comm = stat[stat.index('(') + 1:stat.rindex(')')]
+        fields = stat[stat.rindex(')') + 2:].split()
+        ppid = int(fields[1])
+        info[int(pid)] = (comm, int(fields[21]) * page_size)
+        children.setdefault(ppid, []).append(int(pid))
+
+    root = root_pid or os.getpid()
+    totals = {'flask': info.get(root, ('', 0))[1], 'browser_worker': 0, 'chromium': 0, 'playwright_driver': 0, 'other': 0}
+    pending = list(children.get(root, []))
+    while pending:
+        pid = pending.pop()
+        comm, rss = info[pid]
+        totals[_classify(pid, comm)] += rss
+        pending.extend(children.get(pid, []))
+    return totals
+
+
+def render():
+    return generate_latest(), CONTENT_TYPE_LATEST
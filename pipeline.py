@@ -0,0 +1,438 @@
+import base64
+import logging
+import os
+import time
+
+from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
+
+from audio_store import SCREENSHOT_TYPES, audio_path, screenshot_path
+from diagnostics import diagnostics
+from downloader import download_file, download_progress
+from fast_path import FAST_PATH_ENABLED, ApiRecorder, recipes
+from interception import install as install_interception
+from metrics import StageTimer
+from sites import CONVERSION_STATE_JS, get_site
+
+# Maximum time to wait for the converter to produce a download link
+CONVERSION_MAX_WAIT = float(os.environ.get('CONVERSION_MAX_WAIT', 60))
+# How often the page itself re-evaluates the completion check (no round-trips to Python)
+CONVERSION_POLL_MS = int(os.environ.get('CONVERSION_POLL_MS', 100))
+
+# Debug screenshot defaults - each request may override them
+# 'always', 'on_failure' (deferred - only taken when no audio was produced) or 'never'
+SCREENSHOT_MODES = ('always', 'on_failure', 'never')
+SCREENSHOT_MODE = os.environ.get('SCREENSHOT_MODE', 'always')
+# 'png', 'jpeg' or 'webp' - JPEG/WebP are several times smaller than PNG
+SCREENSHOT_FORMAT = os.environ.get('SCREENSHOT_FORMAT', 'jpeg')
+SCREENSHOT_QUALITY = int(os.environ.get('SCREENSHOT_QUALITY', 70))
+# Clip to this element instead of the whole viewport ("clip": true uses the site's converter panel)
+SCREENSHOT_CLIP_SELECTOR = os.environ.get('SCREENSHOT_CLIP_SELECTOR', '')
+
+
+def _download_url_from_response(response):
+    # Look for a finished download link inside a converter API JSON response
+    try:
+        payload = response.json()
+    except Exception:
+        return None
+
+    pending = [payload]
+    while pending:
+        value = pending.pop()
+        if isinstance(value, dict):
+            pending.extend(value.values())
+        elif isinstance(value, list):
+            pending.extend(value)
+        elif isinstance(value, str) and value.startswith(('http://', 'https://')):
+            if '.mp3' in value.lower() or 'download' in value.lower():
+                return value
+    return None
+
+
+def wait_for_conversion(page, site, max_wait=CONVERSION_MAX_WAIT, checkpoint=None):
+    # Event-driven replacement for the old fixed 30-second sleep. Returns a dict with
+    # state ('ready', 'error' or 'timeout'), the signal that ended the wait and how long it took.
+    # `checkpoint()` is called between wait slices and raises ConversionCancelled to stop early.
+    start_time = time.time()
+    deadline = start_time + max_wait
+    network_hits = []
+
+    def on_response(response):
+        if (site.response_pattern and response.request.resource_type in ('xhr', 'fetch')
+                and response.ok and site.response_pattern.search(response.url)):
+            network_hits.append(response)
+
+    page.on('response', on_response)
+    logging.info(f"⏳ Waiting up to {max_wait:.0f}s for conversion to complete...")
+    try:
+        while True:
+            if checkpoint is not None:
+                checkpoint()
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                waited = round(time.time() - start_time, 2)
+                logging.info(f"⌛ Conversion not finished after {waited:.2f} seconds")
+                return {'state': 'timeout', 'signal': 'deadline', 'href': None, 'message': None, 'waited': waited}
+
+            # Wait in short slices so converter network responses are also noticed promptly
+            try:
+                outcome = page.wait_for_function(
+                    CONVERSION_STATE_JS,
+                    arg=[site.result_selector, site.error_selector, site.result_requires_href],
+                    polling=CONVERSION_POLL_MS,
+                    timeout=min(1000, remaining * 1000)
+                ).json_value()
+                waited = round(time.time() - start_time, 2)
+                logging.info(f"✅ Conversion {outcome['state']} after {waited:.2f} seconds (page signal)")
+                return {
+                    'state': outcome['state'],
+                    'signal': 'dom',
+                    'href': outcome.get('href'),
+                    'message': outcome.get('message'),
+                    'waited': waited
+                }
+            except PlaywrightTimeoutError:
+                pass
+
+            while network_hits:
+                href = _download_url_from_response(network_hits.pop(0))
+                if href:
+                    waited = round(time.time() - start_time, 2)
+                    logging.info(f"✅ Conversion ready after {waited:.2f} seconds (network signal)")
+                    return {'state': 'ready', 'signal': 'network', 'href': href, 'message': None, 'waited': waited}
+    finally:
+        page.remove_listener('response', on_response)
+
+
+def resolve_screenshot_options(overrides=None):
+    # Server defaults overridden per request: false/"never", a mode string, or an object
+    # like {"mode": "on_failure", "format": "webp", "quality": 60, "clip": true}
+    options = {
+        'mode': SCREENSHOT_MODE,
+        'format': SCREENSHOT_FORMAT,
+        'quality': SCREENSHOT_QUALITY,
+        'clip_selector': SCREENSHOT_CLIP_SELECTOR or None,
+    }
+    if overrides is None or overrides is True:
+        overrides = {}
+    elif overrides is False:
+        overrides = {'mode': 'never'}
+    elif isinstance(overrides, str):
+        overrides = {'mode': overrides}
+    elif not isinstance(overrides, dict):
+        raise ValueError('screenshot must be a boolean, a mode or an object')
+
+    if 'mode' in overrides:
+        options['mode'] = overrides['mode']
+    if 'format' in overrides:
+        options['format'] = overrides['format']
+    if 'quality' in overrides:
+        options['quality'] = overrides['quality']
+    if 'clip' in overrides:
+        clip = overrides['clip']
+        if clip is True:
+            # True means "the converter panel of whichever site runs the job"
+            options['clip_selector'] = SCREENSHOT_CLIP_SELECTOR or True
+        elif isinstance(clip, str) and clip:
+            options['clip_selector'] = clip
+        else:
+            options['clip_selector'] = None
+
+    if options['mode'] not in SCREENSHOT_MODES:
+        raise ValueError(f"screenshot mode must be one of {', '.join(SCREENSHOT_MODES)}")
+    if options['format'] not in SCREENSHOT_TYPES:
+        raise ValueError(f"screenshot format must be one of {', '.join(SCREENSHOT_TYPES)}")
+    if not isinstance(options['quality'], int) or not 1 <= options['quality'] <= 100:
+        raise ValueError('screenshot quality must be an integer between 1 and 100')
+    return options
+
+
+def capture_screenshot(page, output_id, options, site):
+    # Saves the screenshot to the spool directory; returns its format, or None if it failed
+    fmt = options['format']
+    path = screenshot_path(output_id, fmt)
+    clip_selector = site.panel_selector if options['clip_selector'] is True else options['clip_selector']
+    logging.info(f"📸 Taking {fmt} screenshot NOW...")
+    try:
+        clip = None
+        if clip_selector:
+            try:
+                clip = page.locator(clip_selector).first.bounding_box(timeout=2000)
+            except Exception:
+                clip = None
+            if clip is None:
+                logging.info(f"Clip element {clip_selector} not found, capturing the viewport")
+
+        if fmt == 'webp':
+            # Playwright only encodes PNG/JPEG - ask Chromium for WebP directly
+            params = {'format': 'webp', 'quality': options['quality']}
+            if clip:
+                params['clip'] = dict(clip, scale=1)
+            session = page.context.new_cdp_session(page)
+            try:
+                data = base64.b64decode(session.send('Page.captureScreenshot', params)['data'])
+            finally:
+                session.detach()
+            with open(path, 'wb') as f:
+                f.write(data)
+        else:
+            kwargs = {'path': path, 'type': fmt, 'full_page': False, 'timeout': 20000, 'animations': 'disabled'}
+            if fmt == 'jpeg':
+                kwargs['quality'] = options['quality']
+            if clip:
+                kwargs['clip'] = clip
+            page.screenshot(**kwargs)
+
+        logging.info(f"✅ Screenshot captured successfully! Size: {os.path.getsize(path)} bytes")
+        return fmt
+    except Exception as e:
+        logging.warning(f"⚠️ Screenshot failed: {e}")
+        return None
+
+
+def navigate_to_converter(page, site, timer):
+    # Navigate to the converter first (increased timeout for slow loads)
+    logging.info(f"Navigating to {site.host}...")
+    with timer.stage('goto'):
+        page.goto(site.url, wait_until='domcontentloaded', timeout=60000)
+
+    # Wait for the site's readiness signal instead of a fixed delay
+    with timer.stage('page_ready'):
+        site.wait_until_ready(page)
+
+
+def prepare_standby_page(context, site, timeout=60, interrupted=None):
+    # Loads the converter ahead of time so a later job can start typing immediately.
+    # Returns the page and its interception counters. Runs between jobs, so the readiness
+    # wait goes in short slices and raises StandbyInterrupted as soon as `interrupted()`
+    # says a job has arrived.
+    page = context.new_page()
+    interception_stats = install_interception(page)
+    deadline = time.time() + timeout
+    try:
+        logging.info(f"Navigating to {site.host} for a standby page...")
+        page.goto(site.url, wait_until='commit', timeout=timeout * 1000)
+        while True:
+            if interrupted is not None and interrupted():
+                raise StandbyInterrupted('A job arrived while the standby page was loading')
+            remaining = deadline - time.time()
+            try:
+                site.wait_until_ready(page, timeout=max(min(1000, remaining * 1000), 1))
+                break
+            except PlaywrightTimeoutError:
+                if remaining <= 1:
+                    raise
+    except Exception:
+        page.close()
+        raise
+    return page, interception_stats
+
+
+class StandbyInterrupted(Exception):
+    # Raised out of prepare_standby_page when the worker has a job to run instead
+    pass
+
+
+class ConversionCancelled(Exception):
+    # Raised out of a progress report when the web process no longer wants the result
+    pass
+
+
+def _report(progress, stage, **data):
+    if progress is not None:
+        progress(stage, **data)
+
+
+def run_conversion(context, url, output_id, screenshot_options, site=None, standby=None, progress=None,
+                   checkpoint=None):
+    # Runs the whole conversion on a context handed out by the browser pool. `standby`
+    # is a converter page the worker already loaded in that context, if it had one.
+    # `progress(stage, **data)` is told about each stage as it starts; `checkpoint()`
+    # raises ConversionCancelled once the web process has given up on this run.
+    site = site or get_site()
+    timer = StageTimer()
+    if standby is not None and standby.site_name != site.name:
+        # Loaded for another converter - close it so only one tab is ever open
+        standby.page.close()
+        standby = None
+    _report(progress, 'launching', site=site.host, standby=standby is not None)
+    if standby is not None:
+        page, interception_stats = standby.page, standby.interception
+        logging.info(f"♨️ Using standby page for {site.host} (loaded {standby.age():.0f}s ago)")
+    else:
+        with timer.stage('page_setup'):
+            page = context.new_page()
+
+            # Apply the interception policy early - global route before navigation
+            logging.info("Setting up request interception (blocking + static asset cache)...")
+            interception_stats = install_interception(page)
+    # Until the fast path has a recipe for this site, record the converter's API calls
+    recorder = ApiRecorder(page) if FAST_PATH_ENABLED and not recipes.has(site.name) else None
+    # Trace and recent requests, written out only if this run fails or turns out slow
+    run_diagnostics = diagnostics.recorder(context, page) if diagnostics is not None else None
+    failure = None
+    try:
+        if standby is None:
+            navigate_to_converter(page, site, timer)
+        _report(progress, 'page_loaded')
+
+        with timer.stage('form_fill'):
+            # Find and click the input box
+            logging.info("Clicking on input box...")
+            input_element = page.locator(site.input_selector).first
+            input_element.click()
+
+            # Fill in the URL
+            logging.info(f"Filling in URL: {url}")
+            input_element.fill(url)
+
+            # Some sites need a moment before the convert button reacts
+            if site.submit_delay_ms:
+                page.wait_for_timeout(site.submit_delay_ms)
+
+            # Click the convert button
+            logging.info("Clicking convert button...")
+            page.locator(site.submit_selector).first.click()
+        _report(progress, 'converting')
+
+        # Wait for the converter to finish - returns as soon as the download link is ready
+        with timer.stage('conversion_wait'):
+            conversion = wait_for_conversion(page, site, checkpoint=checkpoint)
+
+        download_button_found = False
+        download_button_clickable = False
+        audio_size = None
+        download_stats = None
+        download_url = None
+        result_selector = site.result_selector
+
+        if conversion['state'] == 'ready':
+            download_button_found = True
+            download_button_clickable = True
+            download_url = conversion['href']
+            logging.info("✅ Download button found and clickable!")
+        elif conversion['state'] == 'error':
+            logging.info(f"❌ Converter reported an error: {conversion['message']}")
+        else:
+            # Deadline hit - the primary and every fallback selector are checked in one round-trip
+            try:
+                logging.info("🔍 Checking for download button (primary + fallback selectors)...")
+                with timer.stage('result_fallback'):
+                    match = site.resolve_result(page)
+                if match['found'] and match['visible']:
+                    download_button_found = True
+                    result_selector = match['selector']
+                    logging.info(f"✅ Download button found with selector: {match['selector']}")
+                    if match['enabled']:
+                        download_button_clickable = True
+                        download_url = match['href']
+                        logging.info("✅ Download button is clickable!")
+                    else:
+                        logging.info("❌ Download button found but NOT clickable")
+                else:
+                    logging.info("❌ No download button found with any selector")
+            except Exception as button_error:
+                logging.warning(f"Error checking for download button: {button_error}")
+
+        if download_url:
+            # Try to download the file behind the href attribute
+            try:
+                logging.info(f"🎵 Found download URL: {download_url[:100]}...")
+
+                # Stream straight to the spool file - never hold the whole MP3 in memory
+                logging.info("📥 Downloading audio file...")
+                with timer.stage('download'):
+                    download_stats = download_file(download_url, audio_path(output_id),
+                                                   progress=download_progress(progress))
+                audio_size = download_stats.size
+                logging.info(f"✅ Audio file downloaded to disk! Size: {audio_size} bytes")
+            except ConversionCancelled:
+                raise
+            except Exception as download_error:
+                logging.warning(f"⚠️ Could not download via href: {download_error}")
+        elif download_button_clickable:
+            # No href - the button triggers a JS download, so click it and let Chromium save the file
+            try:
+                logging.info("📥 No href attribute found, clicking button for a browser download...")
+                _report(progress, 'download', received=0, total=None)
+                with timer.stage('download'):
+                    with page.expect_download(timeout=60000) as download_info:
+                        page.locator(result_selector).first.click()
+                    download_info.value.save_as(audio_path(output_id))
+                    download_url = download_info.value.url
+                audio_size = os.path.getsize(audio_path(output_id))
+                logging.info(f"✅ Audio file downloaded to disk! Size: {audio_size} bytes")
+            except ConversionCancelled:
+                raise
+            except Exception as download_error:
+                logging.warning(f"⚠️ Button did not trigger a download: {download_error}")
+
+        if recorder is not None and audio_size is not None:
+            recorder.learn(site, url, download_url)
+
+        # NOW take the screenshot of whatever is on the page (if this run wants one)
+        screenshot_format = None
+        if screenshot_options['mode'] == 'always' or (
+                screenshot_options['mode'] == 'on_failure' and audio_size is None):
+            with timer.stage('screenshot'):
+                screenshot_format = capture_screenshot(page, output_id, screenshot_options, site)
+    except ConversionCancelled:
+        logging.info(f"🚫 Conversion on {site.host} cancelled")
+        # Usually the slow attempt a hedge overtook - worth a look
+        failure = 'cancelled'
+        raise
+    except Exception as e:
+        failure = f'error: {e}'
+        # Deferred capture - a crashed run is exactly when the screenshot is worth having
+        if screenshot_options['mode'] != 'never':
+            capture_screenshot(page, output_id, screenshot_options, site)
+        raise
+    finally:
+        logging.info(f"🛡️ Interception: {interception_stats.to_dict()}")
+        if run_diagnostics is not None:
+            if failure is None and audio_size is None:
+                failure = f"no audio (conversion {conversion['state']}, button found: {download_button_found})"
+            run_diagnostics.finish(output_id, failure, {
+                'url': url,
+                'site': site.name,
+                'standby_page': standby is not None,
+                'timings': timer.timings,
+                'interception': interception_stats.to_dict(),
+            })
+        # Explicit cleanup - the pool closes the context, the browser stays warm
+        try:
+            page.close()
+            logging.info("Page closed")
+        except Exception as cleanup_error:
+            logging.warning(f"Error closing page: {cleanup_error}")
+
+    # Prepare status message based on download button findings
+    if conversion['state'] == 'error':
+        status_message = f"❌ Converter reported an error: {conversion['message']}"
+    elif download_button_found:
+        if download_button_clickable:
+            status_message = f'✅ SUCCESS! Download button found and clickable!'
+        else:
+            status_message = f'⚠️ Download button found but NOT clickable'
+    else:
+        status_message = f'❌ Download button NOT found'
+
+    logging.info(f'Processed {url} on {site.host} - Button found: {download_button_found}, Clickable: {download_button_clickable}')
+    return {
+        'status': 'success',
+        'message': status_message,
+        'site': site.name,
+        'screenshot_format': screenshot_format,
+        'screenshot_url': f'/screenshot/{output_id}' if screenshot_format else None,
+        'download_button_found': download_button_found,
+        'download_button_clickable': download_button_clickable,
+        'audio_downloaded': audio_size is not None,
+        'audio_size': audio_size,
+        'conversion_state': conversion['state'],
+        'conversion_signal': conversion['signal'],
+        'conversion_wait_seconds': conversion['waited'],
+        'interception': interception_stats.to_dict(),
+        'standby_page': standby is not None,
+        'download': download_stats.to_dict() if download_stats else None,
+        'timings': timer.timings
+    }
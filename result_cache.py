@@ -0,0 +1,206 @@
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+
+# Where finished conversions are kept between runs
+RESULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR', os.path.expanduser('~/.cache/chromium-launcher/results'))
+# Total audio bytes kept before least recently used entries are evicted
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', 500 * 1024 * 1024))
+# Entries older than this are treated as misses and removed
+RESULT_CACHE_TTL = float(os.environ.get('RESULT_CACHE_TTL', 7 * 24 * 3600))
+# Keep the debugging screenshot alongside the cached result
+RESULT_CACHE_SCREENSHOTS = os.environ.get('RESULT_CACHE_SCREENSHOTS', '0') == '1'
+
+VIDEO_ID_RE = re.compile(r'^[A-Za-z0-9_-]{11}$')
+YOUTUBE_HOSTS = ('youtube.com', 'youtube-nocookie.com', 'youtu.be')
+
+
+def extract_video_id(url):
+    # Canonical YouTube video id for any of the usual URL forms, or None if it isn't one
+    parsed = urlparse(url if '://' in url else 'https://' + url)
+    host = (parsed.hostname or '').lower()
+    if not any(host == h or host.endswith('.' + h) for h in YOUTUBE_HOSTS):
+        return None
+
+    parts = [p for p in parsed.path.split('/') if p]
+    candidate = None
+    if host.endswith('youtu.be'):
+        candidate = parts[0] if parts else None
+    elif parts and parts[0] in ('shorts', 'embed', 'live', 'v', 'e') and len(parts) > 1:
+        candidate = parts[1]
+    else:
+        candidate = parse_qs(parsed.query).get('v', [None])[0]
+
+    if candidate and VIDEO_ID_RE.match(candidate):
+        return candidate
+    return None
+
+
+def _link_or_copy(source, destination):
+    # Hard links make cache hits free when cache and spool share a filesystem
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+    # Linked files share the inode's mtime - refresh it so spool expiry starts from now
+    os.utime(destination)
+
+
+class ResultCache:
+    # Size-bounded LRU of finished conversions keyed by video id.
+    # Each entry is <id>.mp3 plus <id>.json holding the job result, and
+    # optionally <id>.screenshot when RESULT_CACHE_SCREENSHOTS is enabled.
+
+    def __init__(self, directory=RESULT_CACHE_DIR, max_bytes=RESULT_CACHE_MAX_BYTES, ttl=RESULT_CACHE_TTL):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self._load()
+
+    def _paths(self, video_id):
+        base = os.path.join(self.directory, video_id)
+        return base + '.mp3', base + '.json'
+
+    def _screenshot_path(self, video_id):
+        return os.path.join(self.directory, video_id + '.screenshot')
+
+    def _entry_size(self, video_id):
+        audio, _ = self._paths(video_id)
+        size = os.path.getsize(audio)
+        if os.path.exists(self._screenshot_path(video_id)):
+            size += os.path.getsize(self._screenshot_path(video_id))
+        return size
+
+    def _load(self):
+        # Rebuild the index from disk; the metadata file's mtime records the last access
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            video_id = name[:-len('.json')]
+            audio, meta = self._paths(video_id)
+            try:
+                with open(meta) as f:
+                    created_at = json.load(f)['created_at']
+                self._entries[video_id] = {
+                    'size': self._entry_size(video_id),
+                    'created_at': created_at,
+                    'last_access': os.path.getmtime(meta),
+                }
+            except (OSError, ValueError, KeyError):
+                self._remove(video_id)
+        logging.info(f"Result cache loaded {len(self._entries)} entries from {self.directory}")
+
+    def _remove(self, video_id):
+        self._entries.pop(video_id, None)
+        for path in self._paths(video_id) + (self._screenshot_path(video_id),):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def get(self, video_id, audio_destination):
+        # On a hit the cached audio is placed at audio_destination and the stored result returned
+        with self._lock:
+            entry = self._entries.get(video_id) if video_id else None
+            if entry and time.time() - entry['created_at'] > self.ttl:
+                logging.info(f"Cache entry for {video_id} expired")
+                self._remove(video_id)
+                self.evictions += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+
+            audio, meta = self._paths(video_id)
+            try:
+                with open(meta) as f:
+                    result = json.load(f)['result']
+                _link_or_copy(audio, audio_destination)
+                os.utime(meta)
+            except (OSError, ValueError, KeyError) as e:
+                logging.warning(f"Cache entry for {video_id} is unreadable ({e}), dropping it")
+                self._remove(video_id)
+                self.misses += 1
+                return None
+
+            entry['last_access'] = time.time()
+            self.hits += 1
+        logging.info(f"⚡ Cache hit for video {video_id}")
+        return result
+
+    def restore_screenshot(self, video_id, destination):
+        with self._lock:
+            source = self._screenshot_path(video_id)
+            if not os.path.exists(source):
+                return False
+            try:
+                _link_or_copy(source, destination)
+                return True
+            except OSError as e:
+                logging.warning(f"Could not restore cached screenshot for {video_id}: {e}")
+                return False
+
+    def put(self, video_id, audio_source, result, screenshot_source=None):
+        if not video_id or not os.path.exists(audio_source):
+            return
+        result = dict(result)
+        # Spool URLs expire with the job - they are rebuilt on every hit
+        result.pop('audio_url', None)
+        result.pop('screenshot_url', None)
+        if not (RESULT_CACHE_SCREENSHOTS and screenshot_source and os.path.exists(screenshot_source)):
+            screenshot_source = None
+            result.pop('screenshot_format', None)
+
+        with self._lock:
+            audio, meta = self._paths(video_id)
+            try:
+                _link_or_copy(audio_source, audio)
+                if screenshot_source:
+                    _link_or_copy(screenshot_source, self._screenshot_path(video_id))
+                elif os.path.exists(self._screenshot_path(video_id)):
+                    os.remove(self._screenshot_path(video_id))
+                with open(meta + '.tmp', 'w') as f:
+                    json.dump({'created_at': time.time(), 'result': result}, f)
+                os.replace(meta + '.tmp', meta)
+            except OSError as e:
+                logging.warning(f"Could not cache result for {video_id}: {e}")
+                self._remove(video_id)
+                return
+            now = time.time()
+            self._entries[video_id] = {'size': self._entry_size(video_id), 'created_at': now, 'last_access': now}
+            self._evict()
+        logging.info(f"💾 Cached result for video {video_id}")
+
+    def _evict(self):
+        total = sum(entry['size'] for entry in self._entries.values())
+        while total > self.max_bytes and self._entries:
+            oldest = min(self._entries, key=lambda video_id: self._entries[video_id]['last_access'])
+            total -= self._entries[oldest]['size']
+            self._remove(oldest)
+            self.evictions += 1
+            logging.info(f"🧹 Evicted least recently used cache entry {oldest}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': sum(entry['size'] for entry in self._entries.values()),
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,130 @@
+import json
+import logging
+import os
+import re
+
+# Converter site definitions - switching or fixing a site is a config change, not a code change
+CONVERTER_SITES_FILE = os.environ.get(
+    'CONVERTER_SITES_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sites.json')
+)
+# Which adapter from the file handles conversions
+CONVERTER_SITE = os.environ.get('CONVERTER_SITE', 'youconvert')
+
+# Shared page-side helpers. Selectors starting with '//' or 'xpath=' are XPath, anything else is CSS.
+_PAGE_HELPERS_JS = """
+    const find = (selector) => {
+        if (selector.startsWith('xpath=') || selector.startsWith('//')) {
+            return document.evaluate(selector.replace(/^xpath=/, ''), document, null,
+                XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+        }
+        return document.querySelector(selector);
+    };
+    const isVisible = (el) => {
+        const style = window.getComputedStyle(el);
+        const rect = el.getBoundingClientRect();
+        return style.display !== 'none' && style.visibility !== 'hidden' && rect.width > 0 && rect.height > 0;
+    };
+    const isEnabled = (el) => !el.disabled && el.getAttribute('aria-disabled') !== 'true';
+    const hrefOf = (el) => el.href || el.getAttribute('href');
+"""
+
+# Runs inside the page: reports 'ready' once the result element is visible, enabled and
+# (if the site needs it) has an href, or 'error' once the converter shows an error message
+CONVERSION_STATE_JS = """
+([resultSelector, errorSelector, requireHref]) => {
+""" + _PAGE_HELPERS_JS + """
+    const button = find(resultSelector);
+    if (button && isVisible(button) && isEnabled(button)) {
+        const href = hrefOf(button);
+        if (href || !requireHref) {
+            return {state: 'ready', href: href, selector: resultSelector};
+        }
+    }
+    if (errorSelector) {
+        for (const el of document.querySelectorAll(errorSelector)) {
+            const text = el.textContent.trim();
+            if (text && isVisible(el)) {
+                return {state: 'error', message: text.slice(0, 200)};
+            }
+        }
+    }
+    return null;
+}
+"""
+
+# Checks every candidate selector in one round-trip: the first visible match wins,
+# otherwise the first match that exists at all
+RESOLVE_SELECTORS_JS = """
+(selectors) => {
+""" + _PAGE_HELPERS_JS + """
+    let hidden = null;
+    for (const selector of selectors) {
+        let el = null;
+        try {
+            el = find(selector);
+        } catch (e) {
+            continue;
+        }
+        if (!el) {
+            continue;
+        }
+        const match = {selector: selector, found: true, visible: isVisible(el), enabled: isEnabled(el), href: hrefOf(el)};
+        if (match.visible) {
+            return match;
+        }
+        hidden = hidden || match;
+    }
+    return hidden || {selector: null, found: false, visible: false, enabled: false, href: null};
+}
+"""
+
+
+class SiteAdapter:
+    # Everything the pipeline needs to know about one converter site
+
+    def __init__(self, name, url, input_selector, submit_selector, result_selector,
+                 ready_selector=None, fallback_result_selectors=(), result_requires_href=True,
+                 error_selector=None, response_pattern=None, panel_selector=None, submit_delay_ms=0):
+        self.name = name
+        self.url = url
+        self.host = re.sub(r'^https?://', '', url).split('/')[0]
+        self.input_selector = input_selector
+        self.submit_selector = submit_selector
+        self.result_selector = result_selector
+        # Element whose visibility means the page is ready for input
+        self.ready_selector = ready_selector or input_selector
+        self.fallback_result_selectors = list(fallback_result_selectors)
+        self.result_requires_href = result_requires_href
+        self.error_selector = error_selector
+        self.response_pattern = re.compile(response_pattern, re.IGNORECASE) if response_pattern else None
+        self.panel_selector = panel_selector
+        self.submit_delay_ms = submit_delay_ms
+
+    @classmethod
+    def from_dict(cls, name, config):
+        return cls(name=name, **config)
+
+    def wait_until_ready(self, page, timeout=30000):
+        page.locator(self.ready_selector).first.wait_for(state='visible', timeout=timeout)
+
+    def resolve_result(self, page):
+        # Primary and fallback result selectors resolved in a single page.evaluate call
+        return page.evaluate(RESOLVE_SELECTORS_JS, [self.result_selector] + self.fallback_result_selectors)
+
+
+def load_sites(path=CONVERTER_SITES_FILE):
+    with open(path) as f:
+        config = json.load(f)
+    sites = {name: SiteAdapter.from_dict(name, site) for name, site in config.items()}
+    logging.info(f"Loaded converter sites from {path}: {', '.join(sites)}")
+    return sites
+
+
+sites = load_sites()
+
+
+def get_site(name=None):
+    name = name or CONVERTER_SITE
+    if name not in sites:
+        raise ValueError(f"Unknown converter site '{name}' (configured: {', '.join(sites)})")
+    return sites[name]
@@ -0,0 +1,93 @@
+import logging
+import os
+import time
+
+# Reuse cookies and localStorage (consent banners, site preferences) across jobs: new
+# contexts start from the last saved storage state and every finished job saves its own
+BROWSER_STORAGE_STATE = os.environ.get('BROWSER_STORAGE_STATE', '0') == '1'
+# Shared by all browser worker processes; writes are atomic renames
+BROWSER_STORAGE_STATE_FILE = os.environ.get(
+    'BROWSER_STORAGE_STATE_FILE', os.path.expanduser('~/.cache/chromium-launcher/storage_state.json')
+)
+# Saved state is thrown away this long after it was first created, however often it was updated since
+BROWSER_STORAGE_STATE_MAX_AGE = float(os.environ.get('BROWSER_STORAGE_STATE_MAX_AGE', 6 * 3600))
+# ... or as soon as it grows past this size
+BROWSER_STORAGE_STATE_MAX_BYTES = int(os.environ.get('BROWSER_STORAGE_STATE_MAX_BYTES', 1024 * 1024))
+
+
+class StorageStateStore:
+    # Playwright storage_state JSON on disk. A sidecar marker file records when the
+    # current generation started, since every save refreshes the state file itself.
+
+    def __init__(self, path=BROWSER_STORAGE_STATE_FILE, max_age=BROWSER_STORAGE_STATE_MAX_AGE,
+                 max_bytes=BROWSER_STORAGE_STATE_MAX_BYTES):
+        self.path = path
+        self.marker_path = path + '.created'
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.saves = 0
+        self.invalidations = 0
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+
+    def invalidate(self, reason):
+        removed = False
+        for path in (self.path, self.marker_path):
+            try:
+                os.remove(path)
+                removed = True
+            except FileNotFoundError:
+                pass
+        if removed:
+            self.invalidations += 1
+            logging.info(f"🍪 Discarded saved browser storage state ({reason})")
+
+    def _age(self):
+        try:
+            return time.time() - os.path.getmtime(self.marker_path)
+        except OSError:
+            return None
+
+    def current(self):
+        # Path to hand to new_context(storage_state=...), or None when nothing usable is saved
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return None
+        age = self._age()
+        if age is None or age > self.max_age:
+            self.invalidate('expired')
+            return None
+        if size > self.max_bytes:
+            self.invalidate(f'{size} bytes')
+            return None
+        return self.path
+
+    def save(self, context):
+        partial_path = f'{self.path}.{os.getpid()}.tmp'
+        try:
+            context.storage_state(path=partial_path)
+            if os.path.getsize(partial_path) > self.max_bytes:
+                os.remove(partial_path)
+                self.invalidate('grew past the size cap')
+                return
+            if self._age() is None:
+                with open(self.marker_path, 'w') as f:
+                    f.write(str(time.time()))
+            os.replace(partial_path, self.path)
+            self.saves += 1
+        except Exception as e:
+            logging.warning(f"Could not save browser storage state: {e}")
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+
+    def stats(self):
+        age = self._age()
+        return {
+            'saved': os.path.exists(self.path),
+            'age': round(age, 1) if age is not None else None,
+            'saves': self.saves,
+            'invalidations': self.invalidations,
+        }
+
+
+storage_state = StorageStateStore() if BROWSER_STORAGE_STATE else None
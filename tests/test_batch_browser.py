@@ -0,0 +1,87 @@
+import threading
+import time
+from multiprocessing import Pipe
+from types import SimpleNamespace
+
+import pytest
+
+import browser_worker
+from browser_pool import BatchBrowser, BrowserWorkerError
+from test_cancellation import stuck_conversion
+
+
+class FakeBrowser:
+    def __init__(self):
+        self.contexts = 0
+
+    def new_context(self, **options):
+        self.contexts += 1
+        return SimpleNamespace(close=lambda: None)
+
+    def on(self, event, handler):
+        pass
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        pass
+
+
+class FakePlaywright:
+    launches = []
+
+    def __init__(self):
+        self.chromium = SimpleNamespace(launch=self.launch, connect_over_cdp=lambda endpoint: FakeBrowser())
+
+    def launch(self, headless=True, args=()):
+        self.launches.append(list(args))
+        return FakeBrowser()
+
+    def stop(self):
+        pass
+
+
+def which_thread(context, delay):
+    time.sleep(delay)
+    return threading.current_thread().name
+
+
+@pytest.fixture
+def batch_browser(monkeypatch):
+    monkeypatch.setattr(browser_worker, 'sync_playwright', lambda: SimpleNamespace(start=FakePlaywright))
+    monkeypatch.setattr(browser_worker, 'storage_state', None)
+    FakePlaywright.launches.clear()
+    web_side, worker_side = Pipe()
+    worker = threading.Thread(target=browser_worker.serve_shared, args=(worker_side, 'batch', 10, 3), daemon=True)
+    worker.start()
+    browser = BatchBrowser(3)
+    # Talk to the in-process worker instead of spawning one
+    browser._conn = web_side
+    browser._reader = threading.Thread(target=browser._read, daemon=True)
+    browser._reader.start()
+    yield browser
+    web_side.send(('stop',))
+    worker.join(10)
+    assert not worker.is_alive()
+
+
+def test_batch_tasks_run_in_parallel_in_one_shared_chromium(batch_browser):
+    start_time = time.time()
+    futures = [batch_browser.submit(which_thread, 0.5) for _ in range(3)]
+    assert batch_browser.idle() == 0
+    threads = {future.result(timeout=5) for future in futures}
+    assert len(threads) == 3
+    assert time.time() - start_time < 1.4
+    assert batch_browser.idle() == 3
+    # One multi-process browser, launched without '--single-process'
+    assert len(FakePlaywright.launches) == 1
+    assert '--single-process' not in FakePlaywright.launches[0]
+
+
+def test_batch_task_can_be_cancelled(batch_browser):
+    future = batch_browser.submit(stuck_conversion)
+    time.sleep(0.3)
+    assert batch_browser.cancel(future)
+    with pytest.raises(BrowserWorkerError, match='Cancelled'):
+        future.result(timeout=2)
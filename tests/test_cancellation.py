@@ -0,0 +1,70 @@
+import threading
+import time
+from multiprocessing import Pipe
+from types import SimpleNamespace
+
+import pytest
+from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
+
+import browser_worker
+from pipeline import ConversionCancelled, wait_for_conversion
+
+SITE = SimpleNamespace(response_pattern=None, result_selector='#download', error_selector='.error',
+                       result_requires_href=True)
+
+
+class SlowConverterPage:
+    # The download link never shows up; every wait slice times out like Playwright's would
+
+    def on(self, event, handler):
+        pass
+
+    def remove_listener(self, event, handler):
+        pass
+
+    def wait_for_function(self, expression, arg=None, polling=None, timeout=None):
+        time.sleep(min(timeout, 200) / 1000)
+        raise PlaywrightTimeoutError('timed out')
+
+
+def test_wait_for_conversion_stops_at_the_next_slice_once_cancelled():
+    cancelled = threading.Event()
+
+    def checkpoint():
+        if cancelled.is_set():
+            raise ConversionCancelled('Cancelled by the web process')
+
+    threading.Timer(0.3, cancelled.set).start()
+    start_time = time.time()
+    with pytest.raises(ConversionCancelled):
+        wait_for_conversion(SlowConverterPage(), SITE, max_wait=30, checkpoint=checkpoint)
+    assert time.time() - start_time < 1
+
+
+def stuck_conversion(context, checkpoint=None):
+    return wait_for_conversion(SlowConverterPage(), SITE, max_wait=30, checkpoint=checkpoint)
+
+
+def test_cancelled_task_frees_the_worker_without_reporting_progress(monkeypatch):
+    for name in ('start', 'stop', 'maintain_standby', 'check_health'):
+        monkeypatch.setattr(browser_worker.BrowserSession, name, lambda self: None)
+    monkeypatch.setattr(browser_worker.BrowserSession, '_new_context', lambda self: None)
+    monkeypatch.setattr(browser_worker.BrowserSession, '_over_memory_limit', lambda self: False)
+    monkeypatch.setattr(browser_worker.BrowserSession, 'recycle', lambda self, reason: None)
+    monkeypatch.setattr(browser_worker, 'storage_state', None)
+    web_side, worker_side = Pipe()
+    worker = threading.Thread(target=browser_worker.serve, args=(worker_side, 'test-worker', 10), daemon=True)
+    worker.start()
+
+    web_side.send(('run', stuck_conversion, ()))
+    time.sleep(0.5)
+    web_side.send(('cancel',))
+    start_time = time.time()
+    assert web_side.poll(2)
+    kind, message, _health = web_side.recv()
+    assert (kind, message) == ('error', 'Cancelled by the web process')
+    assert time.time() - start_time < 1
+
+    web_side.send(('stop',))
+    worker.join(5)
+    assert not worker.is_alive()
@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+import fast_path
+from fast_path import FastPathError, RecipeStore, learn_recipe, valid_recipe
+from sites import get_site
+
+VIDEO = 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+CALLS = [
+    {'method': 'POST', 'url': 'https://conv.example/api/convert', 'body': json.dumps({'url': VIDEO}),
+     'headers': {'content-type': 'application/json'}, 'status': 200, 'json': {'job': 'job123456'}},
+    {'method': 'GET', 'url': 'https://conv.example/api/status/job123456', 'body': None,
+     'headers': {}, 'status': 200, 'json': {'state': 'done', 'link': '/files/abc.mp3'}},
+]
+
+
+def test_learned_recipes_are_valid():
+    recipe = learn_recipe(CALLS, VIDEO, 'https://conv.example/files/abc.mp3')
+    assert valid_recipe(json.loads(json.dumps(recipe)))
+
+
+@pytest.mark.parametrize('broken', [
+    {},
+    {'steps': [], 'variables': {}, 'download_path': ['link']},
+    {'steps': [{'method': 'GET', 'url': 'https://conv.example/'}], 'variables': {}, 'download_path': ['link']},
+    {'steps': [{'method': 'GET', 'url': 'u', 'body': None, 'headers': {}, 'until': []}],
+     'variables': {'v0': {'step': 3, 'path': ['job']}}, 'download_path': ['link']},
+])
+def test_malformed_recipes_are_dropped(tmp_path, broken):
+    store = RecipeStore(directory=str(tmp_path))
+    (tmp_path / 'youconvert.json').write_text(json.dumps(broken))
+    assert store.load('youconvert') is None
+    assert not store.has('youconvert')
+
+
+def test_partially_written_recipe_is_dropped(tmp_path):
+    store = RecipeStore(directory=str(tmp_path))
+    (tmp_path / 'youconvert.json').write_text('{"steps": [')
+    assert store.load('youconvert') is None
+    assert not store.has('youconvert')
+
+
+def test_unexpected_replay_errors_become_fast_path_errors(tmp_path, monkeypatch):
+    store = RecipeStore(directory=str(tmp_path))
+    store.save('youconvert', learn_recipe(CALLS, VIDEO, 'https://conv.example/files/abc.mp3'))
+    monkeypatch.setattr(fast_path, 'recipes', store)
+
+    def replay(recipe, video_url, session):
+        raise KeyError('link')
+    monkeypatch.setattr(fast_path, 'replay', replay)
+    with pytest.raises(FastPathError):
+        fast_path.convert(VIDEO, 'a' * 32, site=get_site('youconvert'))
@@ -0,0 +1,68 @@
+import threading
+import time
+from concurrent.futures import Future
+
+import hedging
+from hedging import BackendTracker, convert_hedged
+
+
+class FakePool:
+    # Runs each task on a thread: the fast site gets a download link after `link_after`
+    # seconds, every other site waits without a link until it is cancelled
+
+    def __init__(self, fast_site, link_after):
+        self.fast_site = fast_site
+        self.link_after = link_after
+        self.cancelled = {}
+
+    def submit(self, func, url, output_id, screenshot_options, site, progress=None):
+        future = Future()
+        cancelled = self.cancelled[future] = threading.Event()
+
+        def run():
+            progress('launching', site=site.host)
+            if site.name == self.fast_site:
+                time.sleep(self.link_after)
+                progress('download', received=0, total=None)
+                future.set_result({'audio_downloaded': True, 'screenshot_url': None})
+            else:
+                cancelled.wait(5)
+                future.set_result({'audio_downloaded': False, 'message': 'Cancelled'})
+
+        threading.Thread(target=run, daemon=True).start()
+        return future
+
+    def cancel(self, future):
+        self.cancelled[future].set()
+        return True
+
+    def idle(self):
+        return 1
+
+    def set_standby_site(self, site_name):
+        self.standby_site = site_name
+
+
+def test_losing_hedge_site_is_not_promoted_to_primary(monkeypatch):
+    tracker = BackendTracker(['youconvert', 'ezconv'])
+    # Hedge almost immediately so the second site always starts, then always loses
+    monkeypatch.setattr(tracker, 'hedge_delay', lambda name: 0.05)
+    monkeypatch.setattr(hedging, 'backends', tracker)
+    monkeypatch.setattr(hedging, 'CONVERTER_HEDGING', True)
+    monkeypatch.setattr(hedging, '_promote_files', lambda attempt, output_id, result: None)
+    monkeypatch.setattr(hedging, '_discard_files', lambda attempt: None)
+    pool = FakePool('youconvert', link_after=0.3)
+
+    for _ in range(3):
+        result = convert_hedged(pool, 'https://youtu.be/x', 'a' * 32, None, timeout=10)
+        assert [(a['site'], a['outcome']) for a in result['backends']] == [
+            ('youconvert', 'success'), ('ezconv', 'cancelled')
+        ]
+        assert tracker.ranked()[0] == 'youconvert'
+
+    sites = tracker.stats()['sites']
+    assert sites['ezconv']['successes'] == 0
+    assert sites['ezconv']['cancelled'] == 3
+    # Time spent before being cancelled is not a link latency
+    assert sites['ezconv']['p50_link_seconds'] is None
+    assert sites['youconvert']['p50_link_seconds'] >= 0.3
@@ -0,0 +1,34 @@
+from interception import StaticAssetCache, freshness_lifetime, storable
+
+
+def test_only_shareable_responses_are_stored():
+    assert storable(200, {'Cache-Control': 'public, max-age=600'})
+    assert storable(200, {})
+    assert not storable(200, {'Cache-Control': 'no-store'})
+    assert not storable(200, {'cache-control': 'Private, max-age=600'})
+    assert not storable(200, {'set-cookie': 'session=abc'})
+    assert not storable(404, {'cache-control': 'max-age=600'})
+
+
+def test_freshness_follows_cache_control_up_to_the_cap():
+    assert freshness_lifetime({'cache-control': 'max-age=120'}, max_age=3600) == 120
+    assert freshness_lifetime({'cache-control': 'public, max-age=86400'}, max_age=3600) == 3600
+    assert freshness_lifetime({'cache-control': 's-maxage=60, max-age=600'}, max_age=3600) == 60
+    # No explicit lifetime, or no-cache: revalidate on every use
+    assert freshness_lifetime({'cache-control': 'no-cache, max-age=600'}, max_age=3600) == 0
+    assert freshness_lifetime({'etag': '"abc"'}, max_age=3600) == 0
+    assert freshness_lifetime({'cache-control': 'max-age=soon'}, max_age=3600) == 0
+
+
+def test_stored_headers_never_include_cookies(tmp_path):
+    cache = StaticAssetCache(directory=str(tmp_path), flush_interval=0)
+    cache.store('https://example.com/app.js', 200,
+                {'content-type': 'text/javascript', 'Set-Cookie': 'a=b', 'cache-control': 'max-age=30'}, b'js')
+    meta, body = cache.load('https://example.com/app.js')
+    assert body == b'js'
+    assert meta['headers'] == {'content-type': 'text/javascript', 'cache-control': 'max-age=30'}
+    assert meta['fresh_for'] == 30
+
+    cache.touch('https://example.com/app.js', {'cache-control': 'no-cache'})
+    meta, _ = cache.load('https://example.com/app.js')
+    assert meta['fresh_for'] == 0
@@ -0,0 +1,65 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
+
+import browser_worker
+from browser_worker import BrowserSession, StandbyPage
+from pipeline import StandbyInterrupted, prepare_standby_page
+
+
+class SlowPage:
+    def __init__(self):
+        self.closed = False
+
+    def route(self, pattern, handler):
+        pass
+
+    def goto(self, url, wait_until=None, timeout=None):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def is_closed(self):
+        return self.closed
+
+
+class SlowSite:
+    # The converter never becomes ready
+    name = 'youconvert'
+    host = 'youconvert.org'
+    url = 'https://youconvert.org/'
+
+    def wait_until_ready(self, page, timeout=30000):
+        time.sleep(min(timeout, 200) / 1000)
+        raise PlaywrightTimeoutError('not ready')
+
+
+def test_standby_load_stops_when_a_job_arrives():
+    page = SlowPage()
+    context = SimpleNamespace(new_page=lambda: page)
+    job_waiting = threading.Event()
+    threading.Timer(0.3, job_waiting.set).start()
+    start_time = time.time()
+    with pytest.raises(StandbyInterrupted):
+        prepare_standby_page(context, SlowSite(), timeout=30, interrupted=job_waiting.is_set)
+    assert time.time() - start_time < 1
+    assert page.closed
+
+
+def test_standby_page_for_another_site_is_dropped(monkeypatch):
+    session = BrowserSession('test-worker', 10)
+    session._browser = object()
+    session.connected = True
+    closed = []
+    stale = StandbyPage(SimpleNamespace(close=lambda: closed.append('youconvert')), SlowPage(), 'youconvert', None)
+    session.standby = [stale]
+    session.standby_site = 'ezconv'
+    monkeypatch.setattr(browser_worker, 'BROWSER_STANDBY_PAGES', 1)
+
+    session.maintain_standby()
+    assert session.standby == []
+    assert closed == ['youconvert']